@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Measure wall time of emojiart.py started from shell, as when called in a
+loop from scripts, and check that plain ascii art does not load the
+dependencies only other modes need. Exits with 1 when a check fails or
+median time of ascii mode is over --budget.
+
+Usage:
+    startup.py [options]
+
+Options:
+    -h --help                       Show this screen
+    -n=<n> --repeat=<n>             Runs of every command, median is reported [default: 10]
+    -b=<ms> --budget=<ms>           Fail when median of ascii mode is over this many milliseconds
+    -i=<path> --image=<path>        Image to convert [default: test_images/mos.png]
+"""
+from __future__ import print_function
+
+import os
+import subprocess
+import sys
+import time
+
+import docopt
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+PACKAGE_DIR = os.path.join(ROOT, 'emojiart')
+
+COMMANDS = (
+    ('python', ['-c', 'pass']),
+    ('import', ['-c', 'import emojiart']),
+    ('ascii', ['emojiart.py', '-w', '40']),
+    ('edges', ['emojiart.py', '-w', '40', '-e']),
+    ('fill', ['emojiart.py', '-w', '40', '-i']),
+    ('emoji', ['emojiart.py', '-w', '40', '-j']),
+)
+DEFERRED_MODULES = ('scipy', 'cache', 'resources.emojis', 'PIL.ImageDraw')
+ASCII_MODULES_CHECK = '''
+import sys
+from PIL import Image
+import emojiart
+emojiart.AsciiArt(Image.open(sys.argv[1]), width=40).render_to(open(__import__('os').devnull, 'wb'))
+print(' '.join(m for m in sys.argv[2:] if m in sys.modules))
+'''
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2.0
+
+
+def time_command(arguments, repeat):
+    times = []
+    with open(os.devnull, 'wb') as devnull:
+        for _ in range(repeat):
+            start = time.time()
+            subprocess.check_call(
+                [sys.executable] + arguments, cwd=PACKAGE_DIR, stdout=devnull
+            )
+            times.append(time.time() - start)
+    return median(times), min(times)
+
+
+def main():
+    arguments = docopt.docopt(__doc__)
+    repeat = int(arguments['--repeat'])
+    image = os.path.abspath(os.path.join(ROOT, arguments['--image']))
+    failed = False
+    medians = {}
+    print('{:<8} {:>10} {:>10}'.format('command', 'median ms', 'min ms'))
+    for name, command in COMMANDS:
+        if command[0] == 'emojiart.py':
+            command = command + [image]
+        medians[name], best = time_command(command, repeat)
+        print('{:<8} {:>10.1f} {:>10.1f}'.format(name, medians[name] * 1000, best * 1000))
+    loaded = subprocess.check_output(
+        [sys.executable, '-c', ASCII_MODULES_CHECK, image] + list(DEFERRED_MODULES),
+        cwd=PACKAGE_DIR
+    ).decode('ascii').split()
+    if loaded:
+        failed = True
+        print('ascii mode loaded deferred modules: ' + ', '.join(loaded))
+    budget = arguments['--budget']
+    if budget and medians['ascii'] * 1000 > float(budget):
+        failed = True
+        print('ascii mode median {:.1f} ms is over budget of {} ms'.format(
+            medians['ascii'] * 1000, budget
+        ))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+"""
+Time every converter over a matrix of images, widths, symbols sets and
+blur sizes. Every case reports best wall time, output cells per second
+and peak traced memory of its stages, results (with profile of pipeline
+stages) can be saved as JSON and compared against a saved baseline.
+Output bytes per cell are reported too, coloured cases (ANSI escapes)
+can be held to a budget of them.
+
+Peak memory is measured with tracemalloc (Python 3), which sees Python
+and numpy allocations but not PIL internal buffers. On Python 2 it is
+peak resident size of the whole process so far (ru_maxrss), which never
+decreases from case to case. Every case is run once untimed first, so
+imports and lookup tables built on first use are not charged to it.
+
+Usage:
+    suite.py [options]
+
+Options:
+    -h --help                       Show this screen
+    -k=<pt> --filter=<pt>           Run only cases whose name contains pattern
+    -n=<n> --repeat=<n>             Timed runs per case, best one is kept [default: 3]
+    -o=<path> --output=<path>       Save results as JSON
+    -B=<path> --baseline=<path>     Compare with results saved by --output, exit with 1 on regression
+    -T=<t> --tolerance=<t>          Allowed relative slowdown against baseline [default: 0.25]
+    -M=<ms> --min_delta=<ms>        Ignore slowdowns smaller than this many milliseconds [default: 2]
+    -q --quick                      Only the smallest width and one image of each kind
+    -P=<b> --max_bytes_per_cell=<b>  Exit with 1 when output of any case is over this many bytes per cell
+"""
+from __future__ import print_function
+
+import io
+import itertools
+import json
+import os
+import platform
+import sys
+import time
+from collections import OrderedDict
+
+import docopt
+import numpy as np
+from PIL import Image
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'emojiart'))
+from emojiart import AsciiArt, EdgeAsciiArt, EmojiArt, FillAsciiArt, ShapeAsciiArt
+from profiling import Profile
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+BUNDLED_IMAGES = ('test_images/mos.png', 'test_images/greenmagenta.png', 'images/asciiart.png')
+SYNTHETIC_SIZES = ((640, 480), (1920, 1080))
+WIDTHS = (80, 200)
+GAUSS_BLURS = (0, 2)
+EDGE_THREADS = (4,)
+MATCHING_ENGINES = ('kdtree', 'cube')
+COLOR_MODES = ('256', 'truecolor')
+SHAPE_SYMBOLS_SETS = ('small_ascii', 'big_ascii')
+
+
+def synthetic_image(width, height):
+    """Smooth colour gradients with circles and noise, same for every run"""
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    random = np.random.RandomState(0)
+    red = 255 * x / width
+    green = 255 * y / height
+    blue = 127 + 127 * np.sin(x / 23.0) * np.cos(y / 17.0)
+    for _ in range(8):
+        cx, cy, r = random.randint(0, width), random.randint(0, height), random.randint(10, height // 3)
+        inside = (x - cx) ** 2 + (y - cy) ** 2 < r ** 2
+        red[inside], green[inside], blue[inside] = random.randint(0, 256, 3)
+    rgb = np.dstack([red, green, blue]) + random.randint(0, 24, (height, width, 1))
+    image = Image.fromarray(np.clip(rgb, 0, 255).astype(np.uint8), 'RGB')
+    return image.convert('RGBA')
+
+
+def load_images(quick=False):
+    images = OrderedDict()
+    bundled = BUNDLED_IMAGES[:1] if quick else BUNDLED_IMAGES
+    for path in bundled:
+        image = Image.open(os.path.join(ROOT, path))
+        image.load()
+        images[os.path.basename(path)] = image
+    sizes = SYNTHETIC_SIZES[:1] if quick else SYNTHETIC_SIZES
+    for width, height in sizes:
+        images['synthetic{}x{}'.format(width, height)] = synthetic_image(width, height)
+    return images
+
+
+def cases(images, quick=False):
+    """Yield (name, converter class, image, kwargs) of the whole matrix"""
+    widths = WIDTHS[:1] if quick else WIDTHS
+    symbols_sets = sorted(AsciiArt.symbols_sets)
+    for (image_name, image), width in itertools.product(images.items(), widths):
+        prefix = '{}/w{}'.format(image_name, width)
+        for symbols_set_name in symbols_sets:
+            yield (
+                'AsciiArt/{}/{}'.format(prefix, symbols_set_name), AsciiArt, image,
+                dict(width=width, symbols_set_name=symbols_set_name)
+            )
+        for gauss_blur in GAUSS_BLURS:
+            yield (
+                'EdgeAsciiArt/{}/g{}'.format(prefix, gauss_blur), EdgeAsciiArt, image,
+                dict(width=width, gauss_blur=gauss_blur)
+            )
+        for threads in EDGE_THREADS:
+            yield (
+                'EdgeAsciiArt/{}/g2/t{}'.format(prefix, threads), EdgeAsciiArt, image,
+                dict(width=width, gauss_blur=2, threads=threads)
+            )
+        for symbols_set_name in symbols_sets:
+            yield (
+                'FillAsciiArt/{}/{}/g2'.format(prefix, symbols_set_name), FillAsciiArt, image,
+                dict(width=width, symbols_set_name=symbols_set_name, gauss_blur=2)
+            )
+        yield (
+            'FillAsciiArt/{}/small_ascii/g0'.format(prefix), FillAsciiArt, image,
+            dict(width=width, symbols_set_name='small_ascii', gauss_blur=0)
+        )
+        for color in COLOR_MODES:
+            yield (
+                'AsciiArt/{}/small_ascii/c{}'.format(prefix, color), AsciiArt, image,
+                dict(width=width, symbols_set_name='small_ascii', color=color)
+            )
+            yield (
+                'FillAsciiArt/{}/small_ascii/g2/c{}'.format(prefix, color), FillAsciiArt, image,
+                dict(width=width, symbols_set_name='small_ascii', gauss_blur=2, color=color)
+            )
+        for symbols_set_name in SHAPE_SYMBOLS_SETS:
+            yield (
+                'ShapeAsciiArt/{}/{}'.format(prefix, symbols_set_name), ShapeAsciiArt, image,
+                dict(width=width, symbols_set_name=symbols_set_name)
+            )
+        for matching in MATCHING_ENGINES:
+            yield (
+                'EmojiArt/{}/{}'.format(prefix, matching), EmojiArt, image,
+                dict(width=width, matching=matching)
+            )
+
+
+def stages(cls, image, kwargs):
+    """Pairs of (stage name, function) run in order for one conversion"""
+    state = {}
+
+    def prepare():
+        state['art'] = cls(image, seed=0, **kwargs)
+
+    def render():
+        state['output'] = io.BytesIO()
+        state['art'].render_to(state['output'])
+    return [('prepare', prepare), ('render', render)], state
+
+
+def peak_memory(function):
+    if tracemalloc is None:
+        function()
+        if resource is None:
+            return None
+        # kilobytes on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_case(cls, image, kwargs, repeat):
+    run, state = stages(cls, image, kwargs)
+    for _, function in run:
+        function()
+    times = {}
+    for _ in range(repeat):
+        run, state = stages(cls, image, kwargs)
+        for name, function in run:
+            start = time.time()
+            function()
+            elapsed = time.time() - start
+            times[name] = min(times.get(name, elapsed), elapsed)
+    art = state['art']
+    glyph_width, glyph_height = getattr(art, 'glyph_size', (1, 1))
+    cells = (art._pixel_matrix.width // glyph_width) * (art._pixel_matrix.height // glyph_height)
+    output_bytes = len(state['output'].getvalue())
+    run, state = stages(cls, image, kwargs)
+    result = OrderedDict([
+        ('cells', cells),
+        ('bytes_per_cell', output_bytes / float(cells) if cells else None),
+        ('stages', OrderedDict()),
+    ])
+    for name, function in run:
+        result['stages'][name] = OrderedDict([
+            ('seconds', times[name]),
+            ('cells_per_second', cells / times[name] if times[name] else None),
+            ('peak_bytes', peak_memory(function)),
+        ])
+    total = sum(times.values())
+    result['seconds'] = total
+    result['cells_per_second'] = cells / total if total else None
+    run, state = stages(cls, image, kwargs)
+    with Profile() as profile:
+        for _, function in run:
+            function()
+    result['profile'] = profile.as_dict()
+    return result
+
+
+def compare(results, baseline, tolerance, min_delta):
+    """Lines describing stages slower than in baseline beyond tolerance"""
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        for stage, current in result['stages'].items():
+            previous = baseline[name]['stages'].get(stage)
+            if previous is None:
+                continue
+            delta = current['seconds'] - previous['seconds']
+            if delta > min_delta and delta > tolerance * previous['seconds']:
+                regressions.append('{} {}: {:.2f} ms -> {:.2f} ms ({:+.0f}%)'.format(
+                    name, stage, previous['seconds'] * 1000, current['seconds'] * 1000,
+                    100.0 * delta / previous['seconds']
+                ))
+    return regressions
+
+
+def format_memory(peak_bytes):
+    return '-' if peak_bytes is None else '{:.1f}'.format(peak_bytes / 2.0 ** 20)
+
+
+def main():
+    arguments = docopt.docopt(__doc__)
+    quick = arguments['--quick']
+    pattern = arguments['--filter'] or ''
+    repeat = int(arguments['--repeat'])
+    images = load_images(quick)
+    print('{:<52} {:>7} {:>10} {:>10} {:>12} {:>9} {:>7}'.format(
+        'case', 'cells', 'prep ms', 'render ms', 'cells/s', 'peak MB', 'B/cell'
+    ))
+    results = OrderedDict()
+    for name, cls, image, kwargs in cases(images, quick):
+        if pattern not in name:
+            continue
+        result = results[name] = run_case(cls, image, kwargs, repeat)
+        prepare, render = result['stages']['prepare'], result['stages']['render']
+        peaks = [s['peak_bytes'] for s in result['stages'].values()]
+        print('{:<52} {:>7} {:>10.2f} {:>10.2f} {:>12.0f} {:>9} {:>7.2f}'.format(
+            name, result['cells'], prepare['seconds'] * 1000, render['seconds'] * 1000,
+            result['cells_per_second'] or 0,
+            format_memory(None if None in peaks else max(peaks)),
+            result['bytes_per_cell'] or 0
+        ))
+    over_budget = []
+    if arguments['--max_bytes_per_cell']:
+        budget = float(arguments['--max_bytes_per_cell'])
+        over_budget = [
+            '{}: {:.2f} bytes per cell'.format(name, result['bytes_per_cell'])
+            for name, result in results.items()
+            if (result['bytes_per_cell'] or 0) > budget
+        ]
+        print('\n{} cases over budget of {} bytes per cell'.format(len(over_budget), budget))
+        for line in over_budget:
+            print('  ' + line)
+    if arguments['--output']:
+        with open(arguments['--output'], 'w') as f:
+            json.dump(OrderedDict([
+                ('python', platform.python_version()),
+                ('numpy', np.__version__),
+                ('repeat', repeat),
+                ('results', results),
+            ]), f, indent=2)
+    if arguments['--baseline']:
+        with open(arguments['--baseline']) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(
+            results, baseline,
+            float(arguments['--tolerance']), float(arguments['--min_delta']) / 1000.0
+        )
+        print('\n{} of {} cases compared with baseline, {} regressions'.format(
+            len(set(results) & set(baseline)), len(results), len(regressions)
+        ))
+        for line in regressions:
+            print('  ' + line)
+        if regressions:
+            sys.exit(1)
+    if over_budget:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Compare pixels/sec of AsciiArt tone mapping: original per pixel bisect
+loop, with random variant, against whole image lookup table gather.
+
+Usage:
+    python benchmarks/tone_mapping.py
+"""
+import os
+import random
+import sys
+import time
+from bisect import bisect
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'emojiart'))
+from emojiart import AsciiArt
+
+SIZES = ((80, 45), (200, 110), (400, 220))
+SYMBOLS_SETS = ('small_ascii', 'big_ascii')
+
+
+def synthetic_image(width, height):
+    gradient = np.linspace(0, 255, width * height).reshape((height, width))
+    noise = np.random.RandomState(0).randint(0, 64, (height, width))
+    return Image.fromarray(((gradient + noise) % 256).astype(np.uint8), 'L')
+
+
+def bisect_symbols(art):
+    """Per pixel tone mapping as it was before the lookup table"""
+    def change_pixel_to_symbol(pixel, *args):
+        lum = art.MAX_PIXEL - pixel
+        matching_zone_index = bisect(art._zonebounds, lum)
+        possibles = art._symbols_set[matching_zone_index]
+        return possibles[random.randint(0, len(possibles) - 1)]
+    return change_pixel_to_symbol
+
+
+def measure(function, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        function()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    print('{:<12} {:>10} {:>14} {:>14} {:>8}'.format(
+        'set', 'size', 'bisect px/s', 'lut px/s', 'speedup'
+    ))
+    for symbols_set_name in SYMBOLS_SETS:
+        for width, height in SIZES:
+            image = synthetic_image(width, height)
+            art = AsciiArt(
+                image, width=width, height_to_width=1.0,
+                symbols_set_name=symbols_set_name
+            )
+            pixels = art._pixel_matrix
+            number_of_pixels = pixels.width * pixels.height
+            baseline = bisect_symbols(art)
+            bisect_time = measure(lambda: pixels.map(baseline))
+            lut_time = measure(lambda: pixels.map_array(art.pixels_to_symbols))
+            print('{:<12} {:>10} {:>14.0f} {:>14.0f} {:>7.1f}x'.format(
+                symbols_set_name, '{}x{}'.format(pixels.width, pixels.height),
+                number_of_pixels / bisect_time, number_of_pixels / lut_time,
+                bisect_time / lut_time
+            ))
+
+
+if __name__ == '__main__':
+    main()
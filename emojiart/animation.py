@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+import time
+
+import numpy as np
+from PIL import ImageSequence
+
+CLEAR_SCREEN = u'\x1b[2J'
+HIDE_CURSOR = u'\x1b[?25l'
+SHOW_CURSOR = u'\x1b[?25h'
+MOVE_CURSOR = u'\x1b[{};{}H'
+DEFAULT_FRAME_DURATION = 0.1
+
+
+class Animation(object):
+    """
+    Ascii art of multi-frame images. One converter is reused for all frames,
+    only cells whose source pixels changed are converted again, and frames
+    are written as cursor addressed diffs of what is on the screen. Frames
+    are plain symbols, converters with color are rejected.
+    """
+    max_gap = len(MOVE_CURSOR) + 2
+
+    def __init__(self, image, cls, fps=None, **kwargs):
+        if kwargs.get('color'):
+            raise ValueError('animation is drawn without colour')
+        self.image = image
+        self.cls = cls
+        self.fps = fps
+        self.kwargs = kwargs
+
+    def frame_duration(self, frame):
+        if self.fps:
+            return 1.0 / self.fps
+        duration = frame.info.get('duration')
+        return duration / 1000.0 if duration else DEFAULT_FRAME_DURATION
+
+    def iter_frames(self):
+        """Yield symbols array and duration in seconds of every frame"""
+        art = symbols = None
+        for frame in ImageSequence.Iterator(self.image):
+            duration = self.frame_duration(frame)
+            frame = frame.convert('RGBA')
+            if art is None:
+                art = self.cls(frame, **self.kwargs)
+                symbols = np.array(list(art._ascii_rows()), dtype=object)
+            elif art.cellwise:
+                previous = art._pixel_matrix.data
+                art.update_image(frame)
+                pixels = art._pixel_matrix.data
+                changed = previous != pixels
+                if changed.ndim == 3:
+                    changed = changed.any(axis=-1)
+                symbols = symbols.copy()
+                ys, xs = np.nonzero(changed)
+                symbols[ys, xs] = art.cells_to_symbols(pixels[ys, xs], ys, xs)
+            else:
+                art.update_image(frame)
+                symbols = np.array(list(art._ascii_rows()), dtype=object)
+            yield symbols, duration
+
+    def diff(self, displayed, symbols):
+        """Escape codes redrawing cells of symbols that differ from displayed"""
+        out = []
+        for y in np.nonzero((displayed != symbols).any(axis=1))[0]:
+            xs = np.nonzero(displayed[y] != symbols[y])[0].tolist()
+            start = end = xs[0]
+            for x in xs[1:] + [None]:
+                if x is not None and x - end <= self.max_gap:
+                    end = x
+                    continue
+                out.append(MOVE_CURSOR.format(
+                    y + 1, start * self.cls.cell_width + 1
+                ))
+                out.extend(symbols[y, start:end + 1])
+                if x is not None:
+                    start = end = x
+        return u''.join(out).encode('utf-8')
+
+    def iter_diffs(self):
+        """Yield encoded diff and duration of every frame"""
+        displayed = None
+        for symbols, duration in self.iter_frames():
+            if displayed is None:
+                displayed = np.full(symbols.shape, None, dtype=object)
+            yield self.diff(displayed, symbols), duration
+            displayed = symbols
+
+    def play(self, fileobj):
+        """
+        Write frames to binary terminal stream in their durations, frames
+        finished after their time are dropped and drawn with the next one.
+        """
+        fileobj.write((HIDE_CURSOR + CLEAR_SCREEN).encode('utf-8'))
+        displayed = symbols = deadline = None
+        for symbols, duration in self.iter_frames():
+            if deadline is None:
+                deadline = time.time()
+                displayed = np.full(symbols.shape, None, dtype=object)
+            deadline += duration
+            if time.time() <= deadline:
+                fileobj.write(self.diff(displayed, symbols))
+                fileobj.flush()
+                displayed = symbols
+            time.sleep(max(0.0, deadline - time.time()))
+        if symbols is not None and symbols is not displayed:
+            fileobj.write(self.diff(displayed, symbols))
+        height = symbols.shape[0] if symbols is not None else 0
+        fileobj.write(
+            (MOVE_CURSOR.format(height + 1, 1) + SHOW_CURSOR).encode('utf-8')
+        )
+        fileobj.flush()
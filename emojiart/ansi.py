@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+ANSI escape codes colouring symbols in terminal. Colours of cells are
+integer codes, index into xterm 256-colour palette or 24 bit RGB for
+truecolor, so runs of equal colours are found by comparing arrays.
+"""
+import numpy as np
+
+RESET = b'\x1b[0m'
+CUBE_LEVELS = (0, 95, 135, 175, 215, 255)
+
+
+def xterm_palette():
+    """RGB of palette indexes 16-255: 6x6x6 colour cube and 24 grays"""
+    levels = np.array(CUBE_LEVELS)
+    r, g, b = np.meshgrid(levels, levels, levels, indexing='ij')
+    cube = np.stack([r.ravel(), g.ravel(), b.ravel()], axis=1)
+    grays = np.repeat(np.arange(8, 248, 10)[:, np.newaxis], 3, axis=1)
+    return np.concatenate([cube, grays])
+
+
+class AnsiColors(object):
+    """
+    Foreground colours of cells in mode '256' or 'truecolor'. In 256
+    colour mode pixels are mapped to the nearest palette colour by lookup
+    table indexed with lut_bits bits per channel, built once.
+    """
+    modes = ('256', 'truecolor')
+    lut_bits = 5
+    _lut = None
+
+    @staticmethod
+    def get_lut():
+        """Palette index of every colour quantized to lut_bits per channel"""
+        if AnsiColors._lut is None:
+            bits = AnsiColors.lut_bits
+            shift = 8 - bits
+            values = (np.arange(2 ** bits) << shift) + (1 << shift >> 1)
+            g, b = np.meshgrid(values, values, indexing='ij')
+            palette = xterm_palette()
+            norms = (palette ** 2).sum(axis=1)
+            lut = np.empty((2 ** bits,) * 3, dtype=np.uint8)
+            # one plane of red at a time, |c - p|^2 without |c|^2, which
+            # is the same for every p
+            for i, r in enumerate(values):
+                colors = np.stack([np.full(g.size, r), g.ravel(), b.ravel()], axis=1)
+                distances = norms - 2 * colors.dot(palette.T)
+                lut[i] = (distances.argmin(axis=1) + 16).reshape(g.shape)
+            AnsiColors._lut = lut
+        return AnsiColors._lut
+
+    def __init__(self, mode='256'):
+        if mode not in self.modes:
+            raise ValueError('unknown color mode: {}'.format(mode))
+        self.mode = mode
+        if mode == '256':
+            self._escapes = [
+                '\x1b[38;5;{}m'.format(i).encode('ascii') for i in range(256)
+            ]
+
+    def codes(self, rgb):
+        """Colour codes of array of RGB pixels, shape without last axis"""
+        rgb = rgb[..., :3]
+        if self.mode == '256':
+            shift = 8 - self.lut_bits
+            return self.get_lut()[
+                rgb[..., 0] >> shift, rgb[..., 1] >> shift, rgb[..., 2] >> shift
+            ]
+        rgb = rgb.astype(np.uint32)
+        return (rgb[..., 0] << 16) | (rgb[..., 1] << 8) | rgb[..., 2]
+
+    def escape(self, code):
+        if self.mode == '256':
+            return self._escapes[code]
+        return '\x1b[38;2;{};{};{}m'.format(
+            code >> 16, (code >> 8) & 0xff, code & 0xff
+        ).encode('ascii')
+
+    def encode(self, glyphs, indexes, codes):
+        """
+        UTF-8 bytes of one line of glyphs at indexes coloured by codes.
+        Escape is written only where colour changes, blank glyphs take
+        colour of cell before them, and line ends with reset so every
+        line can be printed alone.
+        """
+        blanks = glyphs.blanks[indexes]
+        if blanks.all():
+            return glyphs.encode(indexes)
+        if blanks.any():
+            sources = np.where(blanks, 0, np.arange(len(indexes)))
+            np.maximum.accumulate(sources, out=sources)
+            sources[:blanks.argmin()] = blanks.argmin()
+            codes = codes[sources]
+        starts = np.flatnonzero(codes[1:] != codes[:-1]) + 1
+        bounds = [0] + starts.tolist() + [len(indexes)]
+        out = []
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            out.append(self.escape(int(codes[start])))
+            out.append(glyphs.encode(indexes[start:end]))
+        out.append(RESET)
+        return b''.join(out)
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+import docopt
+import glob
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+from collections import Counter
+
+from PIL import Image
+
+from emojiart import EmojiArt, converter_from_arguments, converter_options
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tif', '.tiff', '.webp')
+
+__doc__ = u"""
+Convert many images at once in a pool of worker processes.
+
+Paths can be image files, directories (searched recursively) or glob
+patterns, - reads newline separated paths from stdin. Every image is
+written to <output_dir> as .txt file at its path relative to directory
+common to all inputs, images differing only in extension keep it
+(x.png.txt, x.jpg.txt).
+
+Usage:
+    batch.py [options] -o=<dir> <path>...
+
+Options:
+    -h --help                       Show this screen
+    -o=<dir> --output_dir=<dir>     Directory to write converted images to
+    -p=<np> --processes=<np>        Number of worker processes, defaults to number of CPUs
+    -x=<ex> --extension=<ex>        Extension of output files [default: .txt]
+""" + converter_options()
+
+
+def collect_tasks(paths, output_dir, extension):
+    """
+    Pairs of (image path, output path) for every image found in paths.
+    Outputs keep paths relative to the deepest directory common to all
+    inputs, images whose names still collide keep their extension, for
+    example x.png.txt and x.jpg.txt, ValueError is raised on collisions
+    left after that.
+    """
+    if paths == ['-']:
+        paths = [line.strip() for line in sys.stdin if line.strip()]
+    images, roots = [], []
+    for path in paths:
+        if os.path.isdir(path):
+            roots.append(path)
+            for root, _, filenames in os.walk(path):
+                for filename in sorted(filenames):
+                    if os.path.splitext(filename)[1].lower() in IMAGE_EXTENSIONS:
+                        images.append(os.path.join(root, filename))
+        else:
+            for image_path in sorted(glob.glob(path)) or [path]:
+                roots.append(os.path.dirname(image_path))
+                images.append(image_path)
+    root = common_directory(roots)
+    tasks, seen = [], set()
+    for image_path in images:
+        if os.path.abspath(image_path) not in seen:
+            seen.add(os.path.abspath(image_path))
+            tasks.append((image_path, os.path.relpath(os.path.abspath(image_path), root)))
+    stems = [os.path.splitext(name)[0] for _, name in tasks]
+    stems_counts = Counter(stems)
+    names = [
+        (stem if stems_counts[stem] == 1 else name) + extension
+        for (_, name), stem in zip(tasks, stems)
+    ]
+    colliding = sorted(name for name, count in Counter(names).items() if count > 1)
+    if colliding:
+        raise ValueError('output names collide: ' + ', '.join(colliding))
+    return [
+        (image_path, os.path.join(output_dir, name))
+        for (image_path, _), name in zip(tasks, names)
+    ]
+
+
+def common_directory(paths):
+    """Deepest directory (absolute) containing all paths"""
+    parts = [os.path.abspath(path).split(os.sep) for path in paths]
+    common = []
+    for components in zip(*parts):
+        if len(set(components)) > 1:
+            break
+        common.append(components[0])
+    return os.sep.join(common) or os.sep
+
+
+def init_worker(cls, kwargs):
+    """Load palette and search structures once per worker process"""
+    global worker_converter
+    worker_converter = cls, kwargs
+    if issubclass(cls, EmojiArt):
+        EmojiArt.get_colors_kd_tree()
+        if kwargs.get('matching') == 'cube':
+            EmojiArt.get_colors_cube(kwargs['quantization'])
+
+
+def convert(task):
+    image_path, output_path = task
+    cls, kwargs = worker_converter
+    start = time.time()
+    try:
+        output_directory = os.path.dirname(output_path)
+        if output_directory and not os.path.isdir(output_directory):
+            try:
+                os.makedirs(output_directory)
+            except OSError:
+                if not os.path.isdir(output_directory):
+                    raise
+        art = cls(Image.open(image_path), **kwargs)
+        with open(output_path, 'wb') as f:
+            art.render_to(f)
+        return image_path, time.time() - start, None
+    except Exception:
+        return image_path, time.time() - start, traceback.format_exc().strip().splitlines()[-1]
+
+
+def run(tasks, cls, kwargs, processes=None, report=sys.stderr):
+    """Convert tasks in a process pool, return number of failed images"""
+    pool = multiprocessing.Pool(processes, init_worker, (cls, kwargs))
+    start = time.time()
+    failed = 0
+    try:
+        for image_path, seconds, error in pool.imap_unordered(convert, tasks):
+            if error:
+                failed += 1
+                report.write('FAILED {:>9.1f} ms  {}: {}\n'.format(seconds * 1000, image_path, error))
+            else:
+                report.write('{:>16.1f} ms  {}\n'.format(seconds * 1000, image_path))
+    finally:
+        pool.close()
+        pool.join()
+    total = time.time() - start
+    report.write('{} images, {} failed, {:.2f} s, {:.1f} images/s\n'.format(
+        len(tasks), failed, total, len(tasks) / total if total else 0.0
+    ))
+    return failed
+
+
+if __name__ == '__main__':
+    arguments = docopt.docopt(__doc__)
+    try:
+        cls, kwargs = converter_from_arguments(arguments)
+        tasks = collect_tasks(
+            arguments['<path>'], arguments['--output_dir'], arguments['--extension']
+        )
+        processes = int(arguments['--processes']) if arguments['--processes'] else None
+    except ValueError as e:
+        sys.exit(str(e))
+    sys.exit(1 if run(tasks, cls, kwargs, processes) else 0)
@@ -0,0 +1,256 @@
+import errno
+import hashlib
+import inspect
+import io
+import os
+import tempfile
+import time
+
+import numpy as np
+from collections import OrderedDict
+
+FORMAT_VERSION = 1
+BUILD_LOCK_TIMEOUT = 120.0
+BUILD_LOCK_POLL = 0.05
+
+getargspec = getattr(inspect, 'getfullargspec', None) or inspect.getargspec
+
+
+def content_key(*parts):
+    """Hash of byte strings identifying the content a cache entry is built from"""
+    digest = hashlib.sha1(str(FORMAT_VERSION).encode('ascii'))
+    for part in parts:
+        digest.update(hashlib.sha1(part).digest())
+    return digest.hexdigest()[:16]
+
+
+def atomic_save(filename, array):
+    """Write array to temp file in the target directory and rename it in place"""
+    atomic_write(filename, lambda f: np.save(f, array))
+
+
+def atomic_write(filename, write):
+    """Call write with temp file in the target directory and rename it in place"""
+    directory = os.path.dirname(filename) or '.'
+    fd, temp_filename = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    renamed = False
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.rename(temp_filename, filename)
+        renamed = True
+    except OSError:
+        if not os.path.exists(filename):
+            raise
+    finally:
+        if not renamed and os.path.exists(temp_filename):
+            os.remove(temp_filename)
+
+
+def load(filename):
+    try:
+        return np.load(filename, mmap_mode='r')
+    except (IOError, ValueError):
+        return None
+
+
+def load_or_create(filename, create):
+    """
+    Load array from filename without locking, on miss build it with create.
+    Only one process builds at a time, others wait for its result. When
+    directory of filename can not be written, array is built and returned
+    without saving.
+    """
+    array = load(filename)
+    if array is not None:
+        return array
+    if not writable_directory(os.path.dirname(filename) or '.'):
+        return create()
+    lock_filename = filename + '.lock'
+    while not _acquire(lock_filename):
+        time.sleep(BUILD_LOCK_POLL)
+        array = load(filename)
+        if array is not None:
+            return array
+    try:
+        array = load(filename)
+        if array is None:
+            atomic_save(filename, create())
+            array = load(filename)
+        return array
+    finally:
+        os.remove(lock_filename)
+
+
+def writable_directory(directory):
+    """Create directory if missing, tell whether files can be written in it"""
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+    except OSError:
+        pass
+    return os.path.isdir(directory) and os.access(directory, os.W_OK)
+
+
+def _acquire(lock_filename):
+    try:
+        os.close(os.open(lock_filename, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        return True
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    try:
+        if time.time() - os.path.getmtime(lock_filename) > BUILD_LOCK_TIMEOUT:
+            os.remove(lock_filename)
+    except OSError:
+        pass
+    return False
+
+
+class RenderCache(object):
+    """
+    Rendered ascii art keyed by decoded image content (with palette and
+    transparency) and normalized converter parameters, kept in memory and
+    optionally on disk, both tiers are size bounded and evict least
+    recently used entries. Rendering is deterministic, so cached output
+    equals rendering again.
+    """
+    version = 3
+    ignored_parameters = ('image', 'max_memory', 'threads')
+
+    def __init__(
+        self, max_memory=64 * 2 ** 20, directory=None, max_disk=2 ** 30
+    ):
+        self.max_memory = max_memory
+        self.directory = directory
+        self.max_disk = max_disk
+        self.memory_hits = self.disk_hits = self.misses = 0
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._disk_size = None
+
+    @property
+    def hits(self):
+        return self.memory_hits + self.disk_hits
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'memory_entries': len(self._memory),
+            'memory_bytes': self._memory_size,
+        }
+
+    @staticmethod
+    def normalized_parameters(cls, kwargs):
+        """Parameters of cls constructor that affect output, with defaults"""
+        parameters = {}
+        for klass in reversed(inspect.getmro(cls)):
+            if '__init__' not in vars(klass) or klass is object:
+                continue
+            spec = getargspec(klass.__init__)
+            defaults = spec.defaults or ()
+            names = spec.args[len(spec.args) - len(defaults):]
+            parameters.update(zip(names, defaults))
+        parameters.update((k, v) for k, v in kwargs.items() if k in parameters)
+        if not parameters.get('width'):
+            parameters['width'] = None
+        if 'seed' in parameters:
+            parameters['seed'] = parameters['seed'] or 0
+        return sorted(
+            (name, float(value) if type(value) in (int, float) else value)
+            for name, value in parameters.items()
+            if name not in RenderCache.ignored_parameters
+        )
+
+    def key(self, cls, image, kwargs):
+        parameters = repr((
+            self.version, cls.__name__, self.normalized_parameters(cls, kwargs)
+        ))
+        palette = image.getpalette() if image.mode in ('P', 'PA') else None
+        return content_key(
+            image.mode.encode('ascii'),
+            repr(image.size).encode('ascii'),
+            image.tobytes(),
+            bytes(bytearray(palette or [])),
+            repr(image.info.get('transparency')).encode('ascii'),
+            parameters.encode('utf-8'),
+        )
+
+    def render(self, cls, image, **kwargs):
+        """Utf-8 encoded output of cls(image, **kwargs).render_to"""
+        key = self.key(cls, image, kwargs)
+        output = self._memory.pop(key, None)
+        if output is not None:
+            self.memory_hits += 1
+        else:
+            output = self._load(key)
+            if output is not None:
+                self.disk_hits += 1
+            else:
+                self.misses += 1
+                output = self._render(cls, image, kwargs)
+                self._save(key, output)
+            self._memory_size += len(output)
+        self._memory[key] = output
+        while self._memory_size > self.max_memory and len(self._memory) > 1:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+        return output
+
+    @staticmethod
+    def _render(cls, image, kwargs):
+        output = io.BytesIO()
+        cls(image, **kwargs).render_to(output)
+        return output.getvalue()
+
+    def _filename(self, key):
+        return os.path.join(self.directory, key + '.txt')
+
+    def _load(self, key):
+        if not self.directory:
+            return None
+        try:
+            with open(self._filename(key), 'rb') as f:
+                output = f.read()
+            os.utime(self._filename(key), None)
+            return output
+        except (IOError, OSError):
+            return None
+
+    def _save(self, key, output):
+        if not self.directory:
+            return
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        atomic_write(self._filename(key), lambda f: f.write(output))
+        if self._disk_size is None:
+            self._disk_size = sum(size for _, size, _ in self._disk_entries())
+        else:
+            self._disk_size += len(output)
+        if self._disk_size > self.max_disk:
+            self._evict_disk()
+
+    def _disk_entries(self):
+        for filename in os.listdir(self.directory):
+            if filename.endswith('.txt'):
+                path = os.path.join(self.directory, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield stat.st_mtime, stat.st_size, path
+
+    def _evict_disk(self):
+        entries = sorted(self._disk_entries())
+        self._disk_size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self._disk_size <= self.max_disk:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self._disk_size -= size
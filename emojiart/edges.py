@@ -1,7 +1,26 @@
 # -*- coding: utf-8 -*-
 from PIL import ImageFilter
 import math
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
+import numpy as np
 from pixelmatrix import PixelMatrix
+import profiling
+
+
+GRADIENT_HALO = 2
+# measured with tracemalloc: blur, Sobel and non-maximum suppression of a
+# strip peak at about 36 bytes per pixel of strip with halo, PIL blur
+# buffers add a few more; hysteresis of a strip needs about 16
+TILE_BYTES_PER_PIXEL = 40
+# whole image planes: magnitudes and orientations (float32), classes, and
+# while connecting edges labels of strong pixels and mask of weak ones
+PLANE_BYTES_PER_PIXEL = 4 + 4 + 1 + 4 + 1
+MIN_BAND_HALOS = 4
+
+HysteresisStats = namedtuple(
+    'HysteresisStats', ['weak_pixels', 'promoted_pixels', 'components', 'passes']
+)
 
 
 class Operator(object):
@@ -10,79 +29,89 @@ class Operator(object):
     prewitt_threshold = (30.0, 10.0)
 
     @staticmethod
-    def operator(gradient_function, d, x, y):
-        gx, gy = gradient_function(d, x, y)
-        g = math.sqrt(gx ** 2 + gy ** 2)
-        o = math.atan2(gy, gx)
-        return g, o, (gx, gy)
+    def operator(gx, gy):
+        gx, gy = gx.astype(np.float32), gy.astype(np.float32)
+        g = np.sqrt(gx ** 2 + gy ** 2)
+        o = np.arctan2(gy, gx)
+        return g, o
+
+    @staticmethod
+    def neighbourhood(pixels, dtype=np.int32):
+        """Return a(dx, dy) giving pixels shifted by (dx, dy), zero outside"""
+        height, width = pixels.shape
+        padded = np.zeros((height + 2, width + 2), dtype=dtype)
+        padded[1:-1, 1:-1] = pixels
+
+        def a(dx, dy):
+            return padded[1 + dy:1 + dy + height, 1 + dx:1 + dx + width]
+        return a
 
     @staticmethod
-    def roberts_cross(v, d, x, y):
-        def xy_gradient(A, x, y):
-            gx = math.sqrt(A.get(x, y, 0)) - math.sqrt(A.get(x + 1, y + 1, 0))
-            gy = math.sqrt(A.get(x + 1, y, 0)) - math.sqrt(A.get(x, y + 1, 0))
-            return gx, gy
-        return Operator.operator(xy_gradient, d, x, y)
+    def roberts_cross(pixels):
+        roots = np.sqrt(pixels.astype(np.float32))
+        a = Operator.neighbourhood(roots, np.float32)
+        gx = a(0, 0) - a(1, 1)
+        gy = a(1, 0) - a(0, 1)
+        return Operator.operator(gx, gy)
 
     @staticmethod
-    def sobel(v, d, x, y):
-        def xy_gradient(A, x, y):
-            def a(x, y):
-                return A.get(x, y, 0)
-            gx, gy = (
-                - a(x - 1, y - 1) + a(x + 1, y - 1) +
-                - 2 * a(x - 1, y) + 2 * a(x + 1, y) +
-                - a(x - 1, y + 1) + a(x + 1, y + 1)
-            ), (
-                - a(x - 1, y - 1) + a(x - 1, y + 1) +
-                - 2 * a(x, y - 1) + 2 * a(x, y + 1) +
-                - a(x + 1, y - 1) + a(x + 1, y + 1)
-            )
-            return gx, gy
-        return Operator.operator(xy_gradient, d, x, y)
+    def sobel(pixels):
+        a = Operator.neighbourhood(pixels)
+        gx, gy = (
+            - a(-1, -1) + a(1, -1) +
+            - 2 * a(-1, 0) + 2 * a(1, 0) +
+            - a(-1, 1) + a(1, 1)
+        ), (
+            - a(-1, -1) + a(-1, 1) +
+            - 2 * a(0, -1) + 2 * a(0, 1) +
+            - a(1, -1) + a(1, 1)
+        )
+        return Operator.operator(gx, gy)
 
     @staticmethod
-    def prewitt(v, d, x, y):
-        def xy_gradient(A, x, y):
-            def a(x, y):
-                return A.get(x, y, 0)
-            gx, gy = (
-                - a(x - 1, y - 1) + a(x + 1, y - 1) +
-                - a(x - 1, y) + a(x + 1, y) +
-                - a(x - 1, y + 1) + a(x + 1, y + 1)
-            ), (
-                - a(x - 1, y - 1) + a(x - 1, y + 1) +
-                - a(x, y - 1) + a(x, y + 1) +
-                - a(x + 1, y - 1) + a(x + 1, y + 1)
-            )
-            return gx, gy
-        return Operator.operator(xy_gradient, d, x, y)
+    def prewitt(pixels):
+        a = Operator.neighbourhood(pixels)
+        gx, gy = (
+            - a(-1, -1) + a(1, -1) +
+            - a(-1, 0) + a(1, 0) +
+            - a(-1, 1) + a(1, 1)
+        ), (
+            - a(-1, -1) + a(-1, 1) +
+            - a(0, -1) + a(0, 1) +
+            - a(1, -1) + a(1, 1)
+        )
+        return Operator.operator(gx, gy)
 
 
 class Filter(object):
+    STRONG = 0
+    WEAK = 125
+    NONE = 255
+
+    non_maximum_suppression_neighbours = (
+        ((-1, 0), (1, 0)),
+        ((-1, -1), (1, 1)),
+        ((0, -1), (0, 1)),
+        ((-1, 1), (1, -1)),
+    )
+
+    @staticmethod
+    def orientation_bins(o):
+        pi8 = math.pi / 8.0
+        bounds = [pi8, 3 * pi8, 5 * pi8, 7 * pi8]
+        return np.digitize(np.abs(o), bounds) % 4
+
     @staticmethod
-    def non_maximum_suppression(v, d, x, y):
-        def o_to_v(o):
-            o = abs(o)
-            pi8 = math.pi / 8.0
-            if o < pi8:
-                return (-1, 0), (1, 0)
-            elif o < 3 * pi8:
-                return (-1, -1), (1, 1)
-            elif o < 5 * pi8:
-                return (0, -1), (0, 1)
-            elif o < 7 * pi8:
-                return (-1, 1), (1, -1)
-            return (-1, 0), (1, 0)
-        g, o, p = v
-        (dx1, dy1), (dx2, dy2) = o_to_v(o)
-        g1, _, _ = d.get(x + dx1, y + dy1, (0, 0, 0))
-        g2, _, _ = d.get(x + dx2, y + dy2, (0, 0, 0))
-        if g < g1:
-            return 0, 0, 0
-        if g < g2:
-            return 0, 0, 0
-        return g, o, p
+    def non_maximum_suppression(g, o):
+        a = Operator.neighbourhood(g, g.dtype)
+        bins = Filter.orientation_bins(o)
+        suppressed = np.zeros(g.shape, dtype=bool)
+        neighbours = Filter.non_maximum_suppression_neighbours
+        for i, ((dx1, dy1), (dx2, dy2)) in enumerate(neighbours):
+            suppressed |= (bins == i) & (
+                (g < a(dx1, dy1)) | (g < a(dx2, dy2))
+            )
+        return np.where(suppressed, 0, g)
 
     @staticmethod
     def connect_edges(v, d, x, y):
@@ -107,15 +136,80 @@ class Filter(object):
         return v
 
     @staticmethod
-    def connect_weak_to_strong_edges(pixel_matrix):
-        grays = pixel_matrix.pixels_with_color(125)
-        prev_len = 0
-        while prev_len != len(grays):
-            prev_len = len(grays)
-            for x, y in list(grays):
-                if Filter.has_strong_neighbour(None, pixel_matrix, x, y):
-                    pixel_matrix[x, y] = 0, pixel_matrix[x, y][1]
-                    grays.remove((x, y))
+    def connect_weak_to_strong_edges(classes, tile_height=None):
+        """
+        Promote weak pixels connected to strong ones. Regions are labeled
+        strip by strip and merged across strip seams, with a single strip
+        it is one labeling pass.
+        """
+        from scipy import sparse
+        from scipy.sparse import csgraph
+        height, width = classes.shape
+        tile_height = tile_height or height
+        strips = [
+            (top, min(top + tile_height, height))
+            for top in range(0, height, tile_height)
+        ]
+        offsets, strong_labels, seams = [], [], []
+        labels_count = 0
+        previous_row = None
+        for top, bottom in strips:
+            labels, count = Filter._label_strip(classes[top:bottom], labels_count)
+            strong_labels.append(labels[classes[top:bottom] == Filter.STRONG])
+            if previous_row is not None:
+                seams.extend(Filter._seam_pairs(previous_row, labels[0]))
+            previous_row = labels[-1]
+            offsets.append(labels_count)
+            labels_count += count
+        nodes = labels_count + 1
+        seams = np.array(seams, dtype=np.int64).reshape((-1, 2)).T
+        components_count, components = csgraph.connected_components(
+            sparse.coo_matrix(
+                (np.ones(seams.shape[1], dtype=bool), seams),
+                shape=(nodes, nodes)
+            ),
+            directed=False
+        )
+        connected = np.zeros(components_count, dtype=bool)
+        connected[components[np.concatenate(strong_labels)]] = True
+        connected = connected[components]
+        connected[0] = False
+        weak_pixels = promoted_pixels = 0
+        for (top, bottom), offset in zip(strips, offsets):
+            strip = classes[top:bottom]
+            if len(strips) > 1:
+                labels, _ = Filter._label_strip(strip, offset)
+            weak = strip == Filter.WEAK
+            promoted = weak & connected[labels]
+            strip[promoted] = Filter.STRONG
+            weak_pixels += int(weak.sum())
+            promoted_pixels += int(promoted.sum())
+        stats = HysteresisStats(
+            weak_pixels=weak_pixels,
+            promoted_pixels=promoted_pixels,
+            components=len(np.unique(components[1:])),
+            passes=1 if len(strips) == 1 else 2,
+        )
+        return classes, stats
+
+    @staticmethod
+    def _label_strip(classes, offset):
+        from scipy import ndimage
+        labels, count = ndimage.label(
+            classes != Filter.NONE, structure=np.ones((3, 3), dtype=bool)
+        )
+        labels[labels > 0] += offset
+        return labels, count
+
+    @staticmethod
+    def _seam_pairs(upper_row, lower_row):
+        pairs = []
+        for dx in (-1, 0, 1):
+            upper = upper_row[max(0, -dx):len(upper_row) - max(0, dx)]
+            lower = lower_row[max(0, dx):len(lower_row) - max(0, -dx)]
+            touching = (upper > 0) & (lower > 0)
+            pairs.extend(zip(upper[touching].tolist(), lower[touching].tolist()))
+        return pairs
 
     @staticmethod
     def color_if_any(color1, color2, *args):
@@ -126,35 +220,131 @@ class Filter(object):
         return f
 
     @staticmethod
-    def filter_weak(v, d, x, y):
-        if v[0] == 0:
-            return 0, v[1]
-        else:
-            return 255, v[1]
-
-    @staticmethod
-    def has_strong_neighbour(v, d, x, y):
-        return any([
-            d.get(x + i, y + j, (255, None))[0] == 0
-            for i in range(-1, 2) for j in range(-1, 2)
-        ])
+    def filter_weak(classes):
+        classes[classes != Filter.STRONG] = Filter.NONE
+        return classes
 
     @staticmethod
     def thresholding(th, tl):
-        def f(v, d, x, y):
-            if v[0] >= th:
-                return 0, v[1]
-            if v[0] >= tl:
-                return 125, v[1]
-            return 255, v[1]
+        def f(g):
+            classes = np.full(g.shape, Filter.NONE, dtype=np.uint8)
+            classes[g >= tl] = Filter.WEAK
+            classes[g >= th] = Filter.STRONG
+            return classes
         return f
 
 
-def find_edges(im, gauss_size=0):
-    im = im.convert("L").filter(ImageFilter.GaussianBlur(gauss_size))
-    pixs = PixelMatrix.from_image(im)
-    s = pixs.map(Operator.sobel).map(Filter.non_maximum_suppression)
-    s = s.map(Filter.thresholding(*Operator.sobel_threshold))
-    Filter.connect_weak_to_strong_edges(s)
-    s = s.map(Filter.filter_weak)
+def edge_planes(im, gauss_size=0, max_memory=None, threads=1, thresholds=None):
+    """
+    Return edges plane (Filter.STRONG or Filter.NONE), orientations and stats.
+    max_memory (bytes) caps memory of finding edges, the input image not
+    counted: whole image planes are taken from it first, the rest is
+    working memory of horizontal strips with halo the image is processed
+    in, ValueError is raised when not even one row fits. With threads
+    strips are processed in parallel threads (blur and numpy kernels
+    release GIL), as many as fit in max_memory, and joined by one
+    hysteresis pass, result is the same. thresholds are (high, low)
+    gradient magnitudes of strong and weak edges.
+    """
+    magnitudes, o, tile_height = gradient_planes(im, gauss_size, max_memory, threads)
+    edges, stats = threshold_edges(magnitudes, thresholds, tile_height)
+    return edges, o, stats
+
+
+def gradient_planes(im, gauss_size=0, max_memory=None, threads=1):
+    """
+    Gradient magnitudes after non-maximum suppression, orientations and
+    height of strips they were computed in, see edge_planes
+    """
+    im = im.convert("L")
+    width, height = im.size
+    halo = blur_halo(gauss_size) + GRADIENT_HALO
+    threads = max(1, threads or 1)
+    budget = None
+    if max_memory:
+        budget = max_memory - PLANE_BYTES_PER_PIXEL * width * height
+        threads = max(1, min(
+            threads, budget // (TILE_BYTES_PER_PIXEL * width * (2 * halo + 1))
+        ))
+    tile_height = height
+    if threads > 1:
+        tile_height = max(-(-height // threads), MIN_BAND_HALOS * halo)
+    if budget is not None:
+        tile_height = min(
+            tile_height,
+            budget // (TILE_BYTES_PER_PIXEL * width * threads) - 2 * halo
+        )
+        if tile_height < 1:
+            raise ValueError('max_memory too small for image size')
+    g = np.empty((height, width), dtype=np.float32)
+    o = np.empty((height, width), dtype=np.float32)
+
+    def process(top):
+        bottom = min(top + tile_height, height)
+        g[top:bottom], o[top:bottom] = strip_gradients(
+            im, top, bottom, gauss_size
+        )
+    tops = range(0, height, tile_height)
+    if threads > 1 and len(tops) > 1:
+        pool = ThreadPool(min(threads, len(tops)))
+        try:
+            pool.map(process, tops)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for top in tops:
+            process(top)
+    return g, o, tile_height
+
+
+def threshold_edges(magnitudes, thresholds=None, tile_height=None):
+    """
+    Edges plane and hysteresis stats of gradient magnitudes, thresholded
+    and connected in strips of tile_height rows
+    """
+    height, width = magnitudes.shape
+    tile_height = tile_height or height
+    threshold = Filter.thresholding(*(thresholds or Operator.sobel_threshold))
+    classes = np.empty((height, width), dtype=np.uint8)
+    for top in range(0, height, tile_height):
+        bottom = min(top + tile_height, height)
+        with profiling.stage('threshold', width * (bottom - top)):
+            classes[top:bottom] = threshold(magnitudes[top:bottom])
+    profiling.import_modules('scipy.ndimage', 'scipy.sparse.csgraph')
+    with profiling.stage('hysteresis', width * height):
+        classes, stats = Filter.connect_weak_to_strong_edges(classes, tile_height)
+    return Filter.filter_weak(classes), stats
+
+
+def blur_halo(gauss_size):
+    """Rows beyond a strip that can influence its Gaussian blur"""
+    return 3 * (int(math.ceil(2 * gauss_size)) + 1)
+
+
+def strip_gradients(im, top, bottom, gauss_size):
+    """Suppressed gradient magnitudes and orientations of rows top:bottom"""
+    width, height = im.size
+    inner_top = max(0, top - GRADIENT_HALO)
+    inner_bottom = min(height, bottom + GRADIENT_HALO)
+    outer_top = max(0, inner_top - blur_halo(gauss_size))
+    outer_bottom = min(height, inner_bottom + blur_halo(gauss_size))
+    with profiling.stage('blur', width * (outer_bottom - outer_top)):
+        strip = im.crop((0, outer_top, width, outer_bottom))
+        strip = strip.filter(ImageFilter.GaussianBlur(gauss_size))
+        pixels = PixelMatrix.from_image(strip).data
+    cells = width * (inner_bottom - inner_top)
+    with profiling.stage('sobel', cells):
+        g, o = Operator.sobel(pixels[inner_top - outer_top:inner_bottom - outer_top])
+    with profiling.stage('non_maximum_suppression', cells):
+        g = Filter.non_maximum_suppression(g, o)
+    core = slice(top - inner_top, bottom - inner_top)
+    return g[core], o[core]
+
+
+def find_edges(im, gauss_size=0, max_memory=None, threads=1, thresholds=None):
+    edges, o, stats = edge_planes(im, gauss_size, max_memory, threads, thresholds)
+    to_tuple = np.frompyfunc(lambda v, o: (v, o), 2, 1)
+    s = PixelMatrix.from_array(to_tuple(edges, o))
+    s.hysteresis_stats = stats
     return s
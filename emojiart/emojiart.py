@@ -1,20 +1,42 @@
 # -*- coding: utf-8 -*-
-from PIL import Image, ImageDraw
+from PIL import Image
 from bisect import bisect
-import random
 import docopt
-import math
-import pickle
-from collections import OrderedDict
-import scipy.spatial.kdtree as kd
-
-from edges import find_edges
+import numpy as np
+import os
+import sys
+from collections import namedtuple
+
+import profiling
+from ansi import AnsiColors
+from edges import Filter, Operator, gradient_planes, threshold_edges
+from glyphs import GlyphAtlas, GlyphTable
 from pixelmatrix import PixelMatrix
-from resources.emojis import emojis
+
+RESOURCES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'resources')
 
 
 class AsciiArt(object):
     MAX_PIXEL = 255
+    cellwise = True
+    cell_width = 1
+    color = None
+    _ansi_colors = None
+    _color_codes = None
+    image_parameters = ('width', 'scale', 'height_to_width')
+    rerender_stages = (
+        ('_rerender_image', image_parameters + ('resample', 'reducing_gap')),
+        ('_rerender_symbols', ('symbols_set_name', 'black_on_white', 'seed')),
+        ('_rerender_colors', ('color',)),
+    )
+    resample_filters = {
+        'nearest': Image.NEAREST,
+        'box': Image.BOX,
+        'bilinear': Image.BILINEAR,
+        'hamming': Image.HAMMING,
+        'bicubic': Image.BICUBIC,
+        'lanczos': Image.LANCZOS,
+    }
 
     symbols_sets = {
         'block': (u' ', u'░', u'▒', u'▓', u'█'),
@@ -50,17 +72,41 @@ class AsciiArt(object):
         width=None,
         scale=1.0, height_to_width=1.8,
         symbols_set_name='big_ascii', black_on_white=False,
+        seed=None, resample=None, reducing_gap=3.0, color=None,
         **kwargs
     ):
-        self._prepare_image(image, width, scale, height_to_width)
-        self._prepare_symbols_set(symbols_set_name, black_on_white)
-        self._prepare_ascii_art()
+        self._prepare_scaling(resample, reducing_gap)
+        self._prepare_colors(color)
+        self._image_args = (width, scale, height_to_width)
+        self._prepare_image(image, *self._image_args)
+        self._prepare_symbols_set(symbols_set_name, black_on_white, seed)
 
     def _prepare_image(self, image, width=None, scale=1.0, height_to_width=1.8):
         self.orginal_image = image
         self._scale_image(image, width, scale, height_to_width)
-        self._image = self._image.convert("L")
-        self._pixel_matrix = PixelMatrix.from_image(self._image)
+        self._convert_image()
+
+    def _convert_image(self):
+        cells = self._image.size[0] * self._image.size[1]
+        self._prepare_color_codes()
+        with profiling.stage('grayscale', cells):
+            self._image = self._image.convert("L")
+        with profiling.stage('pixel_matrix', cells):
+            self._pixel_matrix = PixelMatrix.from_image(self._image)
+
+    def _prepare_color_codes(self):
+        self._color_codes = None
+        if self._ansi_colors is None:
+            return
+        image = self._color_image()
+        with profiling.stage('color_codes', image.size[0] * image.size[1]):
+            self._color_codes = self._ansi_colors.codes(
+                PixelMatrix.from_image(image.convert('RGB')).data
+            )
+
+    def _color_image(self):
+        """Scaled image with one pixel per cell, colours of cells"""
+        return self._scaled_image
 
     def _scale_image(self, image, width, scale, height_to_width):
         iwidth, iheight = image.size
@@ -70,11 +116,57 @@ class AsciiArt(object):
             self.scale = scale
             self.height_to_width = height_to_width
             width, height = int(iwidth * height_to_width * scale), int(iheight * scale)
-        self._image = image.resize((width, height))
+        with profiling.stage('scale', iwidth * iheight):
+            self._image = self._scaled_image = self._resize(image, (width, height))
+
+    def _prepare_scaling(self, resample=None, reducing_gap=3.0):
+        """
+        resample is name of resample_filters, None is PIL default. Images at
+        least reducing_gap times bigger than output are reduced by integer
+        factor first, JPEGs while decoding; None resizes in one step.
+        """
+        self.resample = resample
+        self._resample_filter = self.resample_filters[resample] if resample else None
+        self.reducing_gap = reducing_gap
+
+    def _resize(self, image, size):
+        kwargs = {}
+        if self._resample_filter is not None:
+            kwargs['resample'] = self._resample_filter
+        if self.reducing_gap:
+            image = self._drafted(image, tuple(int(d * self.reducing_gap) for d in size))
+            if hasattr(image, 'reduce'):
+                kwargs['reducing_gap'] = self.reducing_gap
+        return image.resize(size, **kwargs)
 
-    def _prepare_symbols_set(self, set_name, black_on_white=False):
+    @staticmethod
+    def _drafted(image, size):
+        """
+        JPEG image decoded at reduced scale of at least size, other images
+        as they are. draft changes image it is called on, so it is called
+        on copy of not yet loaded JPEG with its own tile and info, which
+        only reads file by offsets of tile; caller's image stays as it was.
+        """
+        if image.format != 'JPEG' or not getattr(image, 'tile', None):
+            return image
+        # copy.copy would decode image through its pickling support
+        drafted = image.__class__.__new__(image.__class__)
+        drafted.__dict__.update(image.__dict__)
+        drafted.tile = list(image.tile)
+        drafted.info = dict(image.info)
+        drafted._exclusive_fp = False
+        drafted.draft(None, size)
+        return drafted
+
+    def _prepare_colors(self, color=None):
+        """color is mode of AnsiColors, None is plain text"""
+        self.color = color
+        self._ansi_colors = AnsiColors(color) if color else None
+
+    def _prepare_symbols_set(self, set_name, black_on_white=False, seed=None):
         self.symbols_set_name = set_name
         self.black_on_white = black_on_white
+        self.seed = seed or 0
 
         symbols_set = self.symbols_sets[set_name]
         if not black_on_white:
@@ -86,123 +178,509 @@ class AsciiArt(object):
         no_zones = len(symbols_set)
         zone_size = self.MAX_PIXEL / no_zones
         self._zonebounds = [i * zone_size for i in range(1, no_zones)]
+        self._prepare_lookup_table(symbols_set)
+
+    def _prepare_lookup_table(self, symbols_set):
+        variants_counts = [len(symbols) for symbols in symbols_set]
+        zones_offsets = np.cumsum([0] + variants_counts[:-1])
+        zones = np.array([
+            bisect(self._zonebounds, self.MAX_PIXEL - pixel)
+            for pixel in range(self.MAX_PIXEL + 1)
+        ])
+        self._symbols = np.array(
+            [symbol for symbols in symbols_set for symbol in symbols],
+            dtype=object
+        )
+        self._symbols_lut = zones_offsets[zones]
+        self._variants_lut = np.array(variants_counts)[zones]
+        self._glyphs = GlyphTable(self._symbols)
+
+    def update_image(self, image):
+        """Prepare new image of the same size, keeping symbols set and scaling"""
+        self._prepare_image(image, *self._image_args)
+
+    def parameters(self):
+        """Current values of keyword arguments rerender can change"""
+        parameters = dict(zip(self.image_parameters, self._image_args))
+        for _, names in self.rerender_stages:
+            parameters.update(
+                (name, getattr(self, name)) for name in names
+                if name not in parameters
+            )
+        return parameters
+
+    def rerender(self, **changed_parameters):
+        """
+        Change keyword arguments of constructor, keeping the same image.
+        Planes computed before the first stage of rerender_stages that
+        depends on a changed argument are reused, only that stage and
+        stages after it are run again. Return self.
+        """
+        parameters = self.parameters()
+        for name in changed_parameters:
+            if name not in parameters:
+                raise TypeError(
+                    "rerender() got an unexpected keyword argument '{}'".format(name)
+                )
+        changed = set(
+            name for name, value in changed_parameters.items()
+            if parameters[name] != value
+        )
+        parameters.update(changed_parameters)
+        first = None
+        for i, (_, names) in enumerate(self.rerender_stages):
+            if changed.intersection(names):
+                first = i
+                break
+        if first is None:
+            return self
+        for method, _ in self.rerender_stages[first:]:
+            getattr(self, method)(parameters)
+        return self
+
+    def _rerender_image(self, parameters):
+        # orginal_image is never drafted, scaling starts from full resolution
+        self._prepare_scaling(parameters['resample'], parameters['reducing_gap'])
+        self._image_args = tuple(parameters[name] for name in self.image_parameters)
+        self._scale_image(
+            self.orginal_image, parameters['width'], parameters['scale'],
+            parameters['height_to_width']
+        )
+        self._convert_image()
+
+    def _rerender_symbols(self, parameters):
+        self._prepare_symbols_set(
+            parameters['symbols_set_name'], parameters['black_on_white'],
+            parameters['seed']
+        )
 
-    def _prepare_ascii_art(self):
-        self._ascii_art_matrix = self._pixel_matrix.map(self.pixel_to_ascii)
+    def _rerender_colors(self, parameters):
+        if parameters['color'] != self.color:
+            self._prepare_colors(parameters['color'])
+            self._prepare_color_codes()
+
+    def _index_rows(self):
+        """Yield rows of indexes into self._glyphs one at a time"""
+        xs = np.arange(self._pixel_matrix.width)
+        for y, pixels in enumerate(self._pixel_matrix.data):
+            yield self.cells_to_indexes(pixels, y, xs)
+
+    def _ascii_rows(self):
+        for indexes in self._index_rows():
+            yield self._glyphs.symbols[indexes]
+
+    def cells_to_indexes(self, pixels, ys=None, xs=None):
+        """
+        Glyph indexes for array of pixels of any shape, each pixel is one
+        cell, ys and xs are their coordinates (default: position in pixels)
+        """
+        return self.pixels_to_indexes(pixels, ys, xs)
+
+    def cells_to_symbols(self, pixels, ys=None, xs=None):
+        return self._glyphs.symbols[self.cells_to_indexes(pixels, ys, xs)]
+
+    def iter_lines(self):
+        """Compute and yield lines of ascii art one at a time"""
+        for row in self._ascii_rows():
+            with profiling.stage('join', len(row)):
+                line = u''.join(row)
+            yield line
+
+    def iter_encoded_lines(self):
+        """
+        Compute and yield utf-8 lines, with newlines, one at a time,
+        coloured with ANSI escapes when converter has color
+        """
+        for y, indexes in enumerate(self._index_rows()):
+            with profiling.stage('encode', len(indexes)):
+                if self._color_codes is None:
+                    line = self._glyphs.encode(indexes)
+                else:
+                    line = self._ansi_colors.encode(
+                        self._glyphs, indexes, self._color_codes[y]
+                    )
+                line += b'\n'
+            yield line
+
+    def render_to(self, fileobj):
+        """Write ascii art line by line to binary file object as utf-8"""
+        fileobj.writelines(self.iter_encoded_lines())
+
+    def pixels_to_symbols(self, pixels, ys=None, xs=None):
+        return self._symbols[self.pixels_to_indexes(pixels, ys, xs)]
+
+    def pixels_to_indexes(self, pixels, ys=None, xs=None):
+        with profiling.stage('tone_mapping', pixels.size):
+            indexes = self._symbols_lut[pixels]
+            variants = self._variants_lut[pixels]
+            if (variants > 1).any():
+                if xs is None:
+                    coordinates = np.indices(pixels.shape)
+                    ys = coordinates[-2] if pixels.ndim > 1 else 0
+                    xs = coordinates[-1]
+                hashes = self.cell_hashes(self.seed, ys, xs)
+                indexes += (hashes * variants) >> 32
+            return indexes
 
-    def pixel_to_ascii(self, pixel, *args):
-        return self.change_pixel_to_symbol(pixel)
+    @staticmethod
+    def cell_hashes(seed, ys, xs):
+        """
+        Uniform pseudo random 32 bit numbers (as int64) that depend only
+        on seed and cell coordinates, so a cell gets the same symbol
+        variant in any row, tile, frame or process
+        """
+        def mix(h):
+            h ^= h >> np.uint32(16)
+            h *= np.uint32(0x7feb352d)
+            h ^= h >> np.uint32(15)
+            h *= np.uint32(0x846ca68b)
+            h ^= h >> np.uint32(16)
+            return h
+        ys, xs = np.broadcast_arrays(ys, xs)
+        with np.errstate(over='ignore'):
+            h = mix(np.full(xs.shape, seed & 0xffffffff, dtype=np.uint32))
+            h = mix(h ^ ys.astype(np.uint32))
+            h = mix(h ^ xs.astype(np.uint32))
+        return h.astype(np.int64)
 
-    def change_pixel_to_symbol(self, pixel):
+    @staticmethod
+    def cell_hash(seed, y, x):
+        """cell_hashes of one cell with Python integers, for per pixel path"""
+        def mix(h):
+            h ^= h >> 16
+            h = (h * 0x7feb352d) & 0xffffffff
+            h ^= h >> 15
+            h = (h * 0x846ca68b) & 0xffffffff
+            h ^= h >> 16
+            return h
+        h = mix(seed & 0xffffffff)
+        h = mix(h ^ (y & 0xffffffff))
+        return mix(h ^ (x & 0xffffffff))
+
+    def pixel_to_ascii(self, pixel, d=None, x=0, y=0):
+        return self.change_pixel_to_symbol(pixel, x, y)
+
+    def change_pixel_to_symbol(self, pixel, x=0, y=0):
         lum = self.MAX_PIXEL - pixel
         matching_zone_index = bisect(self._zonebounds, lum)
         possibles = self._symbols_set[matching_zone_index]
-        return possibles[random.randint(0, len(possibles) - 1)]
+        if len(possibles) == 1:
+            return possibles[0]
+        return possibles[(self.cell_hash(self.seed, y, x) * len(possibles)) >> 32]
 
     def __str__(self):
-        return str(self._ascii_art_matrix)
+        return b''.join(self.iter_encoded_lines())[:-1]
 
 
 class EdgeAsciiArt(AsciiArt):
+    cellwise = False
+    edge_symbols = np.array([u'|', u'/', u'-', u'\\'], dtype=object)
+    _glyphs = GlyphTable(list(edge_symbols) + [u' '])
+    image_parameters = (
+        'width', 'scale', 'height_to_width', 'gauss_blur', 'max_memory', 'threads'
+    )
+    rerender_stages = (
+        ('_rerender_image', AsciiArt.image_parameters + ('resample', 'reducing_gap')),
+        ('_rerender_gradients', ('gauss_blur', 'max_memory', 'threads')),
+        ('_rerender_edges', ('edge_thresholds',)),
+        ('_rerender_colors', ('color',)),
+    )
+
     def __init__(
         self, image,
         width=None,
         scale=1.0, height_to_width=1.8,
         symbols_set_name='big_ascii', black_on_white=False,
-        gauss_blur=2,
+        gauss_blur=2, max_memory=None, resample=None, reducing_gap=3.0,
+        threads=1, color=None, edge_thresholds=None,
         **kwargs
     ):
-        self._prepare_image(image, width, scale, height_to_width, gauss_blur)
-        self._prepare_ascii_art()
+        self._prepare_scaling(resample, reducing_gap)
+        self._prepare_colors(color)
+        self.edge_thresholds = tuple(edge_thresholds or Operator.sobel_threshold)
+        self._image_args = (
+            width, scale, height_to_width, gauss_blur, max_memory, threads
+        )
+        self._prepare_image(image, *self._image_args)
 
-    def _prepare_image(self, image, width, scale, height_to_width, gauss_blur):
+    def _prepare_image(
+        self, image, width, scale, height_to_width, gauss_blur,
+        max_memory=None, threads=1
+    ):
+        self.orginal_image = image
         self._scale_image(image, width, scale, height_to_width)
-        self._image = self._image.convert("L")
-        self._edges_matrix = find_edges(self._image, gauss_blur)
+        self._convert_image()
+        self._prepare_gradients(gauss_blur, max_memory, threads)
+        self._prepare_edges()
+
+    def _prepare_gradients(self, gauss_blur, max_memory=None, threads=1):
+        """Suppressed gradient magnitudes and orientations of grayscale image"""
+        self._magnitudes, self._orientations, self._edges_tile_height = gradient_planes(
+            self._image, gauss_blur, max_memory, threads
+        )
 
-    def _prepare_ascii_art(self):
-        self._ascii_art_matrix = self._edges_matrix.map(self.pixel_to_ascii)
+    def _prepare_edges(self):
+        """Edges (hysteresis mask) of gradient magnitudes and edge_thresholds"""
+        self._edges, self.hysteresis_stats = threshold_edges(
+            self._magnitudes, self.edge_thresholds, self._edges_tile_height
+        )
 
-    def pixel_to_ascii(self, pixel, *args):
-        value, angle = pixel
-        if value > 0:
-            return ' '
-        else:
-            return self.angle_to_symbol(angle)
-
-    def angle_to_symbol(self, angle):
-        angle = abs(angle)
-        pi8 = math.pi / 8.0
-        if angle < pi8:
-            return '|'
-        elif angle < 3 * pi8:
-            return '/'
-        elif angle < 5 * pi8:
-            return '-'
-        elif angle < 7 * pi8:
-            return '\\'
-        return '|'
+    def _rerender_gradients(self, parameters):
+        self._image_args = tuple(parameters[name] for name in self.image_parameters)
+        self._prepare_gradients(
+            parameters['gauss_blur'], parameters['max_memory'], parameters['threads']
+        )
+
+    def _rerender_edges(self, parameters):
+        self.edge_thresholds = tuple(parameters['edge_thresholds'] or Operator.sobel_threshold)
+        self._prepare_edges()
+
+    def _index_rows(self):
+        for edges, orientations in zip(self._edges, self._orientations):
+            yield self.edges_to_indexes(edges, orientations)
+
+    def edges_to_indexes(self, edges, orientations, offset=0):
+        """
+        Indexes of edge_symbols (plus offset) on strong edges, of space
+        following them elsewhere
+        """
+        with profiling.stage('edge_symbols', edges.size):
+            return np.where(
+                edges == Filter.STRONG,
+                Filter.orientation_bins(orientations) + offset,
+                len(self.edge_symbols) + offset
+            )
 
 
 class FillAsciiArt(EdgeAsciiArt):
+    rerender_stages = EdgeAsciiArt.rerender_stages[:-1] + AsciiArt.rerender_stages[1:]
+
+    def __init__(
+        self, image,
+        width=None,
+        scale=1.0, height_to_width=1.8,
+        symbols_set_name='big_ascii', black_on_white=False,
+        gauss_blur=2, max_memory=None,
+        seed=None, resample=None, reducing_gap=3.0, threads=1, color=None,
+        edge_thresholds=None,
+        **kwargs
+    ):
+        self._prepare_scaling(resample, reducing_gap)
+        self._prepare_colors(color)
+        self.edge_thresholds = tuple(edge_thresholds or Operator.sobel_threshold)
+        self._image_args = (
+            width, scale, height_to_width, gauss_blur, max_memory, threads
+        )
+        self._prepare_image(image, *self._image_args)
+        self._prepare_symbols_set(symbols_set_name, black_on_white, seed)
+
+    def _prepare_lookup_table(self, symbols_set):
+        super(FillAsciiArt, self)._prepare_lookup_table(symbols_set)
+        self._glyphs = GlyphTable(
+            list(self._symbols) + list(self.edge_symbols) + [u' ']
+        )
+
+    def _index_rows(self):
+        xs = np.arange(self._pixel_matrix.width)
+        offset = len(self._symbols)
+        rows = zip(self._edges, self._orientations, self._pixel_matrix.data)
+        for y, (edges, orientations, pixels) in enumerate(rows):
+            yield np.where(
+                edges == Filter.STRONG,
+                self.edges_to_indexes(edges, orientations, offset),
+                self.pixels_to_indexes(pixels, y, xs)
+            )
+
+
+class ShapeAsciiArt(AsciiArt):
+    """
+    Every cell is a block of glyph_size pixels replaced by symbol whose
+    rendered bitmap correlates best with it, so symbols follow shapes
+    inside cells and not only their brightness. tone_weight is how much
+    brightness of cell counts against its shape.
+    """
+    cellwise = False
+    match_batch_cells = 2 ** 14
+    tone_weight = 8.0
+    rerender_stages = (
+        ('_rerender_image', AsciiArt.image_parameters + (
+            'resample', 'reducing_gap', 'glyph_width'
+        )),
+        ('_rerender_atlas', ('symbols_set_name', 'black_on_white', 'font_path')),
+        ('_rerender_colors', ('color',)),
+    )
+
     def __init__(
         self, image,
         width=None,
         scale=1.0, height_to_width=1.8,
         symbols_set_name='big_ascii', black_on_white=False,
-        gauss_blur=2,
+        glyph_width=6, font_path=None, resample=None, reducing_gap=3.0,
+        color=None,
         **kwargs
     ):
-        self._prepare_image(image, width, scale, height_to_width, gauss_blur)
-        self._prepare_symbols_set(symbols_set_name, black_on_white)
-        self._prepare_ascii_art()
-
-    def _prepare_ascii_art(self):
-        self._pixel_matrix = PixelMatrix.from_image(self._image)
-        self._ascii_art_matrix = self._edges_matrix.map(self.pixel_to_ascii)
-        self._ascii_art_matrix = self._ascii_art_matrix.map(self.join_two)
-
-    def join_two(self, v, d, x, y):
-        if v != ' ':
-            return v
-        return self.change_pixel_to_symbol(
-            self._pixel_matrix[x, y]
+        self._prepare_glyph_size(glyph_width, height_to_width)
+        self._prepare_scaling(resample, reducing_gap)
+        self._prepare_colors(color)
+        self._image_args = (width, scale, height_to_width)
+        self._prepare_image(image, *self._image_args)
+        self._prepare_atlas(symbols_set_name, black_on_white, font_path)
+
+    def _prepare_glyph_size(self, glyph_width, height_to_width):
+        self.glyph_width = glyph_width
+        self.glyph_size = (
+            glyph_width, max(1, int(round(glyph_width * height_to_width)))
+        )
+
+    def _rerender_image(self, parameters):
+        self._prepare_glyph_size(
+            parameters['glyph_width'], parameters['height_to_width']
         )
+        super(ShapeAsciiArt, self)._rerender_image(parameters)
 
+    def _rerender_atlas(self, parameters):
+        self._prepare_atlas(
+            parameters['symbols_set_name'], parameters['black_on_white'],
+            parameters['font_path']
+        )
 
-class AvgColor(object):
-        BIG_NUM = 256 * 3
+    def _resize(self, image, size):
+        glyph_width, glyph_height = self.glyph_size
+        return super(ShapeAsciiArt, self)._resize(
+            image, (size[0] * glyph_width, size[1] * glyph_height)
+        )
 
-        def __init__(self, channels):
-            super(AvgColor, self).__init__()
-            self.channels = channels
-            self.channels_values = OrderedDict([(c, []) for c in channels])
+    def _color_image(self):
+        glyph_width, glyph_height = self.glyph_size
+        width, height = self._scaled_image.size
+        return self._scaled_image.resize(
+            (width // glyph_width, height // glyph_height), Image.BOX
+        )
 
-        def add(self, pixel):
-            for channel, channel_value in zip(self.channels, pixel):
-                self.channels_values[channel].append(channel_value)
+    def _prepare_atlas(self, set_name, black_on_white=False, font_path=None):
+        self.symbols_set_name = set_name
+        self.black_on_white = black_on_white
+        self.font_path = font_path
+        symbols = []
+        for group in self.symbols_sets[set_name]:
+            symbols.extend(s for s in group if s not in symbols)
+        with profiling.stage('glyph_atlas', len(symbols)):
+            atlas = GlyphAtlas.get(symbols, self.glyph_size, font_path)
+        self._glyphs = GlyphTable(atlas.symbols)
+        # distance of block to glyph is squared distance of their shapes
+        # (both without mean) plus weighted squared distance of tones, with
+        # glyph tones scaled so darkest glyph is full tone; expanded it is
+        # norms - 2 * block . weights, one product for all cells
+        means = atlas.bitmaps.mean(axis=1)
+        tones = means / max(means.max(), 1e-6)
+        shapes = atlas.bitmaps - means[:, np.newaxis]
+        self._match_weights = (shapes + self.tone_weight * tones[:, np.newaxis]).T
+        self._match_norms = (shapes ** 2).sum(axis=1) + (
+            self.tone_weight * atlas.bitmaps.shape[1] * tones ** 2
+        )
 
-        def calculate(self):
-            return [
-                sum(v) / len(v) if v else self.BIG_NUM for v in self.channels_values.values()
-            ]
+    def _index_rows(self):
+        glyph_height = self.glyph_size[1]
+        pixels = self._pixel_matrix.data
+        rows = pixels.shape[0] // glyph_height
+        columns = pixels.shape[1] // self.glyph_size[0]
+        batch = max(1, self.match_batch_cells // max(columns, 1))
+        for top in range(0, rows, batch):
+            bottom = min(top + batch, rows)
+            for indexes in self.blocks_to_indexes(
+                pixels[top * glyph_height:bottom * glyph_height]
+            ):
+                yield indexes
+
+    def blocks_to_indexes(self, pixels):
+        """
+        Glyph indexes of blocks of pixels, closest in shape and tone,
+        computed for all blocks with one matrix multiplication
+        """
+        glyph_width, glyph_height = self.glyph_size
+        rows = pixels.shape[0] // glyph_height
+        columns = pixels.shape[1] // glyph_width
+        with profiling.stage('shape_matching', rows * columns):
+            blocks = pixels[:rows * glyph_height, :columns * glyph_width].reshape(
+                (rows, glyph_height, columns, glyph_width)
+            ).swapaxes(1, 2).reshape((rows * columns, glyph_height * glyph_width))
+            ink = blocks.astype(np.float32) * (1.0 / self.MAX_PIXEL)
+            if self.black_on_white:
+                ink = 1 - ink
+            distances = self._match_norms - 2 * ink.dot(self._match_weights)
+            return distances.argmin(axis=1).reshape((rows, columns))
+
+
+TileGrid = namedtuple(
+    'TileGrid', ['tile_width', 'tile_height', 'columns', 'rows']
+)
+TileGrid.__new__.__defaults__ = (None, None)
 
 
 class EmojiArt(AsciiArt):
+    cell_width = 2
+    match_batch_cells = 2 ** 16
+    EMPTY_TILE_COLOR = 256 * 3
+    emojis_image_path = os.path.join(RESOURCES_DIR, 'emojis.png')
+    emojis_grid = TileGrid(tile_width=47, tile_height=47)
+    cache_dir = os.environ.get('EMOJIART_CACHE_DIR', RESOURCES_DIR)
+    _palette_key = None
+    _emoji_average_colors = None
+    _colors_kd_tree = None
+    _colors_cubes = {}
+    matching_engines = {
+        'kdtree': 'pixels_to_emoji_indexes',
+        'cube': 'pixels_to_emoji_indexes_with_cube',
+    }
+    rerender_stages = (
+        AsciiArt.rerender_stages[0],
+        ('_rerender_matching', ('matching', 'quantization')),
+    )
+    _emojis = None
+    _emoji_glyphs = None
+
+    @staticmethod
+    def get_emojis():
+        """Emojis of sprite sheet tiles, loaded on first use"""
+        if EmojiArt._emojis is None:
+            from resources.emojis import emojis
+            EmojiArt._emojis = emojis
+        return EmojiArt._emojis
+
     @staticmethod
-    def _load_or_create(filename, create):
-        try:
-            with open(filename) as f:
-                return pickle.load(f)
-        except (IOError, EOFError):
-            with open(filename, 'w') as f:
-                creation = create()
-                pickle.dump(creation, f)
-                return creation
+    def get_emoji_glyphs():
+        """GlyphTable of emojis followed by space for empty tiles"""
+        if EmojiArt._emoji_glyphs is None:
+            EmojiArt._emoji_glyphs = GlyphTable(
+                list(EmojiArt.get_emojis()) + [u' ']
+            )
+        return EmojiArt._emoji_glyphs
+
+    @staticmethod
+    def get_palette_key():
+        """Hash of sprite sheet and emojis list, changes when any of them does"""
+        if EmojiArt._palette_key is None:
+            import cache
+            with open(EmojiArt.emojis_image_path, 'rb') as f:
+                sheet = f.read()
+            EmojiArt._palette_key = cache.content_key(
+                sheet,
+                u'\n'.join(EmojiArt.get_emojis()).encode('utf-8'),
+                repr(tuple(EmojiArt.emojis_grid)).encode('ascii'),
+            )
+        return EmojiArt._palette_key
+
+    @staticmethod
+    def _cache_filename(name, *args):
+        parts = (name, EmojiArt.get_palette_key()) + args
+        return os.path.join(
+            EmojiArt.cache_dir, '_'.join(str(p) for p in parts) + '.npy'
+        )
 
     @staticmethod
     def _create_emojis_colors_test_image(colors, width, height, filename):
         im = Image.new('RGBA', (width, len(colors) * height), (255, 255, 255, 255))
+        from PIL import ImageDraw
         draw = ImageDraw.Draw(im)
         for i, color in enumerate(colors):
             color = tuple(color)
@@ -211,52 +689,175 @@ class EmojiArt(AsciiArt):
         im.save('test_images/' + filename, 'PNG')
 
     @staticmethod
-    def convert_emojis_to_colors():
-        emojis_image_path = 'resources/emojis.png'
-        emojis_image = Image.open(emojis_image_path)
-        width, height = emojis_image.size
-        emoji_height = 47
-        base_y = 0
-        processed_emojis_counter = 0
-        emoji_colors = []
-        while base_y + emoji_height < height:
-            avgs = AvgColor(['red', 'green', 'blue'])
-            for x in range(0, width):
-                for y in range(base_y, base_y + emoji_height):
-                    pixel = emojis_image.getpixel((x, y))
-                    if pixel[3] == 255:
-                        avgs.add(pixel)
-            emoji_colors.append(avgs.calculate())
-            processed_emojis_counter += 1
-            base_y += emoji_height
-        return emoji_colors
+    def convert_emojis_to_colors(grid=None):
+        """Average color of opaque pixels of every tile, row by row"""
+        grid = grid or EmojiArt.emojis_grid
+        pixels = PixelMatrix.from_image(
+            Image.open(EmojiArt.emojis_image_path).convert('RGBA')
+        ).data
+        height, width = pixels.shape[:2]
+        columns = grid.columns or width // grid.tile_width
+        rows = grid.rows or height // grid.tile_height
+        tiles = pixels[:rows * grid.tile_height, :columns * grid.tile_width]
+        tiles = tiles.reshape(
+            (rows, grid.tile_height, columns, grid.tile_width, 4)
+        ).swapaxes(1, 2).reshape((rows * columns, -1, 4))
+        opaque = tiles[..., 3] == 255
+        counts = opaque.sum(axis=1)
+        sums = (tiles[..., :3] * opaque[..., None]).sum(axis=1, dtype=np.int64)
+        return np.where(
+            counts[:, None] > 0,
+            sums // np.maximum(counts, 1)[:, None],
+            EmojiArt.EMPTY_TILE_COLOR
+        )
 
     @staticmethod
     def get_emoji_average_colors():
-        emoji_colors = EmojiArt._load_or_create(
-            'resources/emoji_colors.pickle',
-            EmojiArt.convert_emojis_to_colors
-        )
-        return emoji_colors
+        if EmojiArt._emoji_average_colors is None:
+            import cache
+            EmojiArt._emoji_average_colors = cache.load_or_create(
+                EmojiArt._cache_filename('emoji_colors'),
+                lambda: EmojiArt.convert_emojis_to_colors().astype(np.int32)
+            )
+        return EmojiArt._emoji_average_colors
 
-    def __init__(self, *args, **kwargs):
-        self.emoji_average_colors = EmojiArt.get_emoji_average_colors()
-        super(EmojiArt, self).__init__(*args, **kwargs)
+    @staticmethod
+    def get_colors_kd_tree():
+        """Tree over unique palette colors and their first emoji indexes"""
+        if EmojiArt._colors_kd_tree is None:
+            from scipy.spatial import cKDTree
+            colors = np.array(EmojiArt.get_emoji_average_colors())
+            colors, indexes = np.unique(colors, axis=0, return_index=True)
+            EmojiArt._colors_kd_tree = cKDTree(colors), indexes
+        return EmojiArt._colors_kd_tree
 
-    def _prepare_image(self, image, width, scale, height_to_width):
-        self._scale_image(image, width, scale, height_to_width)
-        self._pixel_matrix = PixelMatrix.from_image(self._image)
+    @staticmethod
+    def create_colors_cube(quantization):
+        """Emoji index for center of every quantized RGB cell"""
+        levels = 1 << quantization
+        step = 256 >> quantization
+        centers = np.arange(levels) * step + step // 2
+        r, g, b = np.meshgrid(centers, centers, centers, indexing='ij')
+        colors = np.column_stack((r.ravel(), g.ravel(), b.ravel()))
+        tree, emojis_indexes = EmojiArt.get_colors_kd_tree()
+        indexes = emojis_indexes[tree.query(colors)[1]]
+        indexes = np.minimum(indexes, len(EmojiArt.get_emojis())).astype(np.uint16)
+        return indexes.reshape((levels, levels, levels))
+
+    @staticmethod
+    def get_colors_cube(quantization):
+        EmojiArt.check_quantization(quantization)
+        if quantization not in EmojiArt._colors_cubes:
+            import cache
+            EmojiArt._colors_cubes[quantization] = cache.load_or_create(
+                EmojiArt._cache_filename('emoji_colors_cube', quantization),
+                lambda: EmojiArt.create_colors_cube(quantization)
+            )
+        return EmojiArt._colors_cubes[quantization]
 
-    def _prepare_ascii_art(self):
-        self._pixel_matrix = PixelMatrix.from_image(self._image)
-        self.colors_kd_tree = kd.KDTree(self.emoji_average_colors)
-        self._ascii_art_matrix = self._pixel_matrix.map(self.pixel_to_ascii)
+    @staticmethod
+    def check_quantization(quantization):
+        if not 1 <= quantization <= 8:
+            raise ValueError(
+                'quantization must be from 1 to 8 bits, got {}'.format(quantization)
+            )
+
+    def __init__(
+        self, image,
+        width=None,
+        scale=1.0, height_to_width=1.8,
+        matching='kdtree', quantization=5,
+        **kwargs
+    ):
+        self._prepare_matching(matching, quantization)
+        profiling.import_modules('cache')
+        with profiling.stage('palette'):
+            self.emoji_average_colors = EmojiArt.get_emoji_average_colors()
+        super(EmojiArt, self).__init__(
+            image, width, scale, height_to_width, **kwargs
+        )
+        self._glyphs = EmojiArt.get_emoji_glyphs()
+
+    def _convert_image(self):
+        with profiling.stage('pixel_matrix', self._image.size[0] * self._image.size[1]):
+            self._pixel_matrix = PixelMatrix.from_image(self._image)
+
+    def _prepare_matching(self, matching, quantization):
+        if matching not in self.matching_engines:
+            raise ValueError('unknown matching engine: {}'.format(matching))
+        EmojiArt.check_quantization(quantization)
+        self.matching = matching
+        self.quantization = quantization
+
+    def _rerender_matching(self, parameters):
+        self._prepare_matching(parameters['matching'], parameters['quantization'])
+
+    def _index_rows(self):
+        """
+        Yield rows of emoji indexes, matched in batches of rows of about
+        match_batch_cells cells, so unique colors are found and looked up
+        once per batch and not per row
+        """
+        pixels = self._pixel_matrix.data
+        batch = max(1, self.match_batch_cells // max(pixels.shape[1], 1))
+        for top in range(0, pixels.shape[0], batch):
+            for indexes in self.cells_to_indexes(pixels[top:top + batch]):
+                yield indexes
+
+    def cells_to_indexes(self, pixels, ys=None, xs=None):
+        matching_engine = getattr(self, self.matching_engines[self.matching])
+        return matching_engine(pixels)
+
+    def pixels_to_emoji_indexes(self, pixels):
+        colors = pixels[..., :3].reshape((-1, 3)).astype(np.uint32)
+        with profiling.stage('unique_colors', len(colors)):
+            keys = (colors[:, 0] << 16) | (colors[:, 1] << 8) | colors[:, 2]
+            unique_keys, inverse = np.unique(keys, return_inverse=True)
+            unique_colors = np.column_stack((
+                unique_keys >> 16, (unique_keys >> 8) & 0xff, unique_keys & 0xff
+            ))
+        profiling.import_modules('scipy.spatial')
+        with profiling.stage('palette'):
+            tree, emojis_indexes = EmojiArt.get_colors_kd_tree()
+        with profiling.stage('kdtree_query', len(unique_colors)):
+            indexes = emojis_indexes[tree.query(unique_colors)[1]]
+            indexes = np.minimum(indexes, len(EmojiArt.get_emojis()))
+        return indexes[inverse].reshape(pixels.shape[:-1])
+
+    def pixels_to_emoji_indexes_with_cube(self, pixels):
+        with profiling.stage('palette'):
+            cube = EmojiArt.get_colors_cube(self.quantization)
+        with profiling.stage('cube_lookup', pixels.size // pixels.shape[-1]):
+            shift = 8 - self.quantization
+            return cube[
+                pixels[..., 0] >> shift,
+                pixels[..., 1] >> shift,
+                pixels[..., 2] >> shift,
+            ]
 
-    def pixel_to_ascii(self, pixel, *args):
-        index = self.colors_kd_tree.query([pixel[:3]])[1][0]
-        if index >= len(emojis):
-            return ' '
-        return emojis[index]
+CONVERTER_OPTIONS = u"""\
+    -w=<ws> --width=<ws>            Width of output
+    -s=<sc> --scale=<sc>            Resize image by this value before conversion [default: 1.0]
+    -f=<fs> --height_to_width=<fs>  Rescale width by this value to match fonts height to width proportion [default: 1.8]
+    -c=<na> --symbols_set=<na>      Name of symbols set to use, possible values: {} [default: small_ascii]
+    -b --black_on_white             Reverse symbols set
+    -n=<sd> --seed=<sd>             Seed of symbol variants picked in multi-symbol groups [default: 0]
+    -e --edges                      Ascii art is created only from edges
+    -i --fill                       Ascii art contains edges
+    -j --emoji                      Use emojis
+    -y --shape                      Match symbols to shapes inside cells of glyph size
+    -z=<gw> --glyph_width=<gw>      Width in pixels of cell matched by shape [default: 6]
+    -F=<path> --font=<path>         Font to render symbols matched by shape with
+    -m=<me> --matching=<me>         Emoji matching engine, possible values: {} [default: kdtree]
+    -q=<qb> --quantization=<qb>     Bits per channel of emoji colors cube [default: 5]
+    -g=<gs> --gauss=<gs>            Size of Gauss blur to use when finding edges [default: 0]
+    -E=<th> --edge_thresholds=<th>  High and low gradient magnitudes of strong and weak edges [default: 30,10]
+    -t=<mb> --max_memory=<mb>       Cap memory of finding edges at this many MB, whole image planes included
+    -k=<nt> --threads=<nt>          Find edges in horizontal bands in this many parallel threads [default: 1]
+    -l=<rf> --resample=<rf>         Resampling filter used when scaling, possible values: {}
+    -C=<cm> --color=<cm>            Colour symbols with ANSI escapes, possible values: {}
+    -d=<rg> --reducing_gap=<rg>     Reduce images this many times bigger than output by integer factor before resampling, 0 disables [default: 3]
+"""
 
 __doc__ = u"""
 Convert images to aciiart-like text with unicode symbols or emojis.
@@ -279,25 +880,28 @@ Convert images to aciiart-like text with unicode symbols or emojis.
                  ░░▒▒▒░░
 
 Usage:
-    textart.py [-s=<sc>] [-f=<fs>] [-c=<na>] [-b] [-g=<gs>] [-e] [-i] [-j] [-w=<ws>] <path_to_image>
+    textart.py [-s=<sc>] [-f=<fs>] [-c=<na>] [-b] [-n=<sd>] [-g=<gs>] [-E=<th>] [-e] [-i] [-j] [-y] [-z=<gw>] [-F=<path>] [-m=<me>] [-q=<qb>] [-t=<mb>] [-k=<nt>] [-l=<rf>] [-C=<cm>] [-d=<rg>] [-a] [-r=<fps>] [-p] [-w=<ws>] <path_to_image>
 
 Options:
     -h --help                       Show this screen
-    -w=<ws> --width=<ws>            Width of output
-    -s=<sc> --scale=<sc>            Resize image by this value before conversion [default: 1.0]
-    -f=<fs> --height_to_width=<fs>  Rescale width by this value to match fonts height to width proportion [default: 1.8]
-    -c=<na> --symbols_set=<na>      Name of symbols set to use, possible values: {} [default: small_ascii]
-    -b --black_on_white             Reverse symbols set
-    -e --edges                      Ascii art is created only from edges
-    -i --fill                       Ascii art contains edges
-    -j --emoji                      Use emojis
-    -g=<gs> --gauss=<gs>            Size of Gauss blur to use when finding edges [default: 0]
-""".format(', '.join(AsciiArt.symbols_sets.keys()))
+    -a --animate                    Play frames of animated image as terminal animation, without colour
+    -r=<fps> --fps=<fps>            Frame rate of animation, defaults to frame durations of image
+    -p --profile                    Print time, peak memory and cells of every stage to stderr
+"""
 
 
-if __name__ == '__main__':
-    arguments = docopt.docopt(__doc__)
-    image = Image.open(arguments['<path_to_image>'])
+def converter_options():
+    """CONVERTER_OPTIONS with possible values filled in, for docopt"""
+    return CONVERTER_OPTIONS.format(
+        ', '.join(AsciiArt.symbols_sets.keys()),
+        ', '.join(EmojiArt.matching_engines.keys()),
+        ', '.join(sorted(AsciiArt.resample_filters)),
+        ', '.join(AnsiColors.modes),
+    )
+
+
+def converter_from_arguments(arguments):
+    """Converter class and its keyword arguments from parsed CONVERTER_OPTIONS"""
     cls = AsciiArt
     if arguments['--edges']:
         cls = EdgeAsciiArt
@@ -305,12 +909,52 @@ if __name__ == '__main__':
         cls = FillAsciiArt
     if arguments['--emoji']:
         cls = EmojiArt
-    print(cls(
-        image,
+    if arguments['--shape']:
+        cls = ShapeAsciiArt
+    edge_thresholds = tuple(
+        float(t) for t in arguments['--edge_thresholds'].split(',')
+    )
+    if len(edge_thresholds) != 2:
+        raise ValueError('edge_thresholds must be high and low value: high,low')
+    if arguments.get('--animate') and arguments['--color']:
+        raise ValueError('--animate cannot be used with --color, frames are drawn without colour')
+    return cls, dict(
         width=int(arguments['--width'] if arguments['--width'] else 0),
         scale=float(arguments['--scale']),
         height_to_width=float(arguments['--height_to_width']),
         symbols_set_name=arguments['--symbols_set'],
         black_on_white=arguments['--black_on_white'],
-        gauss_blur=float(arguments['--gauss'])
-    ))
+        seed=int(arguments['--seed']),
+        gauss_blur=float(arguments['--gauss']),
+        edge_thresholds=edge_thresholds,
+        max_memory=int(float(arguments['--max_memory'] or 0) * 2 ** 20) or None,
+        threads=int(arguments['--threads']),
+        matching=arguments['--matching'],
+        quantization=int(arguments['--quantization']),
+        resample=arguments['--resample'],
+        reducing_gap=float(arguments['--reducing_gap']) or None,
+        glyph_width=int(arguments['--glyph_width']),
+        font_path=arguments['--font'],
+        color=arguments['--color'],
+    )
+
+
+if __name__ == '__main__':
+    arguments = docopt.docopt(__doc__ + converter_options())
+    try:
+        cls, kwargs = converter_from_arguments(arguments)
+    except ValueError as e:
+        sys.exit(str(e))
+    image = Image.open(arguments['<path_to_image>'])
+    stdout = getattr(sys.stdout, 'buffer', sys.stdout)
+    if arguments['--animate']:
+        from animation import Animation
+        fps = float(arguments['--fps']) if arguments['--fps'] else None
+        Animation(image, cls, fps, **kwargs).play(stdout)
+    elif arguments['--profile']:
+        with profiling.Profile(memory=True) as profile:
+            cls(image, **kwargs).render_to(stdout)
+        stdout.flush()
+        sys.stderr.write(profile.format() + '\n')
+    else:
+        cls(image, **kwargs).render_to(stdout)
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+import os
+
+import numpy as np
+
+
+class GlyphTable(object):
+    """
+    Symbols and their UTF-8 bytes, encoded once. Arrays of symbol indexes
+    are turned into output bytes by one gather, without creating string
+    for any cell.
+    """
+
+    def __init__(self, symbols):
+        self.symbols = np.array(list(symbols), dtype=object)
+        encoded = [symbol.encode('utf-8') for symbol in self.symbols]
+        # shorter symbols are padded with zero bytes, which UTF-8 of
+        # symbols never contains, so padding is removed by value
+        self.encoded = np.array(encoded, dtype=bytes)
+        self.fixed_length = len(set(len(e) for e in encoded)) == 1
+        self.blanks = np.array([not symbol.strip() for symbol in self.symbols])
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def encode(self, indexes):
+        """UTF-8 bytes of symbols at indexes, in row major order"""
+        raw = self.encoded[indexes].view(np.uint8)
+        if self.fixed_length:
+            return raw.tobytes()
+        return raw[raw != 0].tobytes()
+
+
+class GlyphAtlas(object):
+    """
+    Symbols rendered with a font into cells of glyph_size pixels, bitmaps
+    are rows of ink coverage from 0 to 1. Atlases are built once per
+    symbols, size and font.
+    """
+    font_paths = (
+        os.environ.get('EMOJIART_FONT', ''),
+        '/usr/share/fonts/truetype/dejavu/DejaVuSansMono.ttf',
+        '/usr/share/fonts/TTF/DejaVuSansMono.ttf',
+        '/usr/share/fonts/dejavu/DejaVuSansMono.ttf',
+        '/System/Library/Fonts/Menlo.ttc',
+        'C:\\Windows\\Fonts\\consola.ttf',
+    )
+    supersampling = 4
+    _atlases = {}
+
+    @staticmethod
+    def get(symbols, glyph_size, font_path=None):
+        key = (tuple(symbols), tuple(glyph_size), font_path)
+        if key not in GlyphAtlas._atlases:
+            GlyphAtlas._atlases[key] = GlyphAtlas(symbols, glyph_size, font_path)
+        return GlyphAtlas._atlases[key]
+
+    @staticmethod
+    def load_font(font_path, size):
+        from PIL import ImageFont
+        for path in ((font_path,) if font_path else GlyphAtlas.font_paths):
+            if path and os.path.exists(path):
+                return ImageFont.truetype(path, size)
+        if font_path:
+            raise IOError('font not found: {}'.format(font_path))
+        return ImageFont.load_default()
+
+    def __init__(self, symbols, glyph_size, font_path=None):
+        from PIL import Image, ImageDraw
+        self.symbols = list(symbols)
+        self.glyph_size = glyph_size
+        width, height = glyph_size
+        font = self.load_font(font_path, height * self.supersampling)
+        advances = [self._text_width(font, symbol) for symbol in self.symbols]
+        cell_width = max(max(advances), 1)
+        cell_height = self._line_height(font)
+        bitmaps = np.zeros((len(self.symbols), width * height), dtype=np.float32)
+        for i, (symbol, advance) in enumerate(zip(self.symbols, advances)):
+            canvas = Image.new('L', (cell_width, cell_height), 0)
+            try:
+                ImageDraw.Draw(canvas).text(
+                    ((cell_width - advance) // 2, 0), symbol, fill=255, font=font
+                )
+            except UnicodeError:
+                continue
+            bitmap = canvas.resize((width, height), Image.BOX)
+            bitmaps[i] = np.frombuffer(bitmap.tobytes(), dtype=np.uint8) / 255.0
+        self.bitmaps = bitmaps
+
+    @staticmethod
+    def _text_width(font, text):
+        try:
+            if hasattr(font, 'getlength'):
+                return int(round(font.getlength(text)))
+            return font.getsize(text)[0]
+        except UnicodeError:
+            return 0
+
+    @staticmethod
+    def _line_height(font):
+        if hasattr(font, 'getmetrics'):
+            return sum(font.getmetrics())
+        return font.getsize(u'Mg')[1]
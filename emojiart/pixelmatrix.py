@@ -1,9 +1,20 @@
+import numpy as np
+
+
 class Matrix(object):
     join_symbol = ''
 
-    def __init__(self, width, height):
+    def __init__(self, width, height, dtype=object):
         self.width, self.height = width, height
-        self.data = [[0 for _ in range(width)] for _ in range(height)]
+        self.data = np.zeros((height, width), dtype=dtype)
+
+    @classmethod
+    def from_array(cls, data):
+        height, width = data.shape[:2]
+        matrix = cls.__new__(cls)
+        matrix.width, matrix.height = width, height
+        matrix.data = data
+        return matrix
 
     def __str__(self):
         return u'\n'.join(
@@ -15,11 +26,13 @@ class Matrix(object):
         x, y = index
         if x < 0 or y < 0:
             raise IndexError
-        return self.data[y][x]
+        if self.data.ndim == 2:
+            return self.data.item(y, x)
+        return tuple(self.data[y, x].tolist())
 
     def __setitem__(self, index, value):
         x, y = index
-        self.data[y][x] = value
+        self.data[y, x] = value
 
     def get(self, x, y, v=None):
         try:
@@ -34,23 +47,41 @@ class Matrix(object):
                 new_matrix[x, y] = mapper(self[x, y], self, x, y)
         return new_matrix
 
+    def map_array(self, mapper):
+        """Map whole matrix at once, mapper takes and returns numpy array"""
+        return self.from_array(mapper(self.data))
+
     def empty(self):
         return Matrix(self.width, self.height)
 
 
 class PixelMatrix(Matrix):
+    _mode_dtypes = {
+        'I': np.int32,
+        'F': np.float32,
+    }
+
     @classmethod
     def from_image(cls, image):
-        pixels = image.load()
+        if image.mode == '1':
+            image = image.convert('L')
         width, height = image.size
-        matrix = cls(width, height)
-        for x in range(width):
-            for y in range(height):
-                matrix[x, y] = pixels[x, y]
+        dtype = cls._mode_dtypes.get(image.mode, np.uint8)
+        data = np.frombuffer(image.tobytes(), dtype=dtype).copy()
+        bands = len(image.getbands())
+        if bands == 1:
+            data = data.reshape((height, width))
+        else:
+            data = data.reshape((height, width, bands))
+        matrix = cls.from_array(data)
         matrix.image = image
         return matrix
 
     def pixels_with_color(self, color):
+        if self.data.dtype != object:
+            data = self.data if self.data.ndim == 2 else self.data[..., 0]
+            ys, xs = np.nonzero(data == color)
+            return set(zip(xs.tolist(), ys.tolist()))
         s = set()
         for x in range(self.width):
             for y in range(self.height):
@@ -59,4 +90,6 @@ class PixelMatrix(Matrix):
         return s
 
     def empty(self):
-        return PixelMatrix.from_image(self.image)
+        matrix = PixelMatrix(self.width, self.height)
+        matrix.image = getattr(self, 'image', None)
+        return matrix
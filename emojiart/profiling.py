@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+Duration, peak traced memory and cells of conversion stages. Stages are
+recorded only inside an active Profile, otherwise stage() returns one
+shared no-op context manager.
+"""
+import importlib
+import sys
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+StageStats = namedtuple(
+    'StageStats', ['calls', 'seconds', 'peak_bytes', 'cells']
+)
+
+_active = None
+
+
+class _NoStage(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_no_stage = _NoStage()
+
+
+def stage(name, cells=0):
+    """Record block as stage name of active profile, processing cells"""
+    if _active is None:
+        return _no_stage
+    return _Stage(_active, name, cells)
+
+
+def import_modules(*names):
+    """
+    Import modules not imported yet as stage 'import', so the stage that
+    first uses them is charged only with its own work
+    """
+    missing = [name for name in names if name not in sys.modules]
+    if missing:
+        with stage('import'):
+            for name in missing:
+                importlib.import_module(name)
+
+
+class _Stage(object):
+    def __init__(self, profile, name, cells):
+        self.profile = profile
+        self.name = name
+        self.cells = cells
+
+    def __enter__(self):
+        self.memory = self.peak = self.profile.open_stage(self)
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.time() - self.start
+        memory = self.profile.close_stage(self)
+        peak = None if memory is None else self.peak - self.memory
+        self.profile.add(self.name, seconds, peak, self.cells)
+        return False
+
+
+class Profile(object):
+    """
+    Report of stages run while it is active, repeated stages (rows, strips)
+    are summed. With memory, allocations are traced with tracemalloc where
+    it can reset its peak (Python 3.9+), peak_bytes is the most a stage had
+    allocated above memory at its start, the largest of its calls; stages
+    running at once in threads see each other's allocations. peak_bytes
+    is None without memory tracing.
+    """
+
+    def __init__(self, memory=False):
+        self.memory = memory and hasattr(tracemalloc, 'reset_peak')
+        self.stages = OrderedDict()
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+        self._open = []
+
+    def __enter__(self):
+        global _active
+        if self.memory:
+            tracemalloc.start()
+        self._previous, _active = _active, self
+        self._start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        global _active
+        self.seconds += time.time() - self._start
+        _active = self._previous
+        if self.memory:
+            tracemalloc.stop()
+        return False
+
+    def _update_peaks(self):
+        """Pass traced peak since last reset to open stages, reset it"""
+        current, peak = tracemalloc.get_traced_memory()
+        for stage in self._open:
+            stage.peak = max(stage.peak, peak)
+        tracemalloc.reset_peak()
+        return current
+
+    def open_stage(self, stage):
+        """Traced memory at start of stage, None without memory"""
+        if not self.memory:
+            return None
+        with self._lock:
+            current = self._update_peaks()
+            self._open.append(stage)
+            return current
+
+    def close_stage(self, stage):
+        if not self.memory:
+            return None
+        with self._lock:
+            current = self._update_peaks()
+            self._open.remove(stage)
+            return current
+
+    def add(self, name, seconds, peak_bytes, cells):
+        with self._lock:
+            stats = self.stages.get(name)
+            if stats is None:
+                self.stages[name] = StageStats(1, seconds, peak_bytes, cells)
+                return
+            if peak_bytes is not None:
+                peak_bytes = max(peak_bytes, stats.peak_bytes)
+            self.stages[name] = StageStats(
+                stats.calls + 1, stats.seconds + seconds,
+                peak_bytes, stats.cells + cells
+            )
+
+    def as_dict(self):
+        return OrderedDict([
+            ('seconds', self.seconds),
+            ('stages', OrderedDict(
+                (name, stats._asdict()) for name, stats in self.stages.items()
+            )),
+        ])
+
+    def format(self):
+        lines = ['{:<24} {:>7} {:>10} {:>7} {:>12} {:>10}'.format(
+            'stage', 'calls', 'ms', '%', 'cells', 'peak kB'
+        )]
+        for name, stats in self.stages.items():
+            lines.append('{:<24} {:>7} {:>10.2f} {:>6.1f}% {:>12} {:>10}'.format(
+                name, stats.calls, stats.seconds * 1000,
+                100.0 * stats.seconds / self.seconds if self.seconds else 0.0,
+                stats.cells,
+                'n/a' if stats.peak_bytes is None
+                else '{:.1f}'.format(stats.peak_bytes / 1024.0)
+            ))
+        other = self.seconds - sum(s.seconds for s in self.stages.values())
+        lines.append('{:<24} {:>7} {:>10.2f}'.format('other', '', other * 1000))
+        lines.append('{:<24} {:>7} {:>10.2f}'.format('total', '', self.seconds * 1000))
+        return '\n'.join(lines)
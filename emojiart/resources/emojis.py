@@ -831,4 +831,4 @@ emojis = [
 
 
 if __name__ == '__main__':
-    print '\n'.join(emojis)
+    print('\n'.join(emojis))
@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+"""
+Serve image conversion over HTTP from a pool of worker processes.
+Needs Python 3.7+ for asyncio.
+
+POST image bytes to /ascii, /edges, /fill, /shape or /emoji, conversion
+options go to query string with names of emojiart.py long options, for
+example /fill?width=80&symbols_set=block&black_on_white. Only options of
+CLIENT_PARAMETERS can be set, others and outputs wider than --max_width
+cells are rejected with 400. Concurrent requests of the same mode are
+converted in batches, requests over --max_in_flight are rejected with
+503, as are requests whose worker process died; the pool is started
+again for next requests.
+
+Usage:
+    server.py [-H=<host>] [-p=<port>] [-n=<np>] [-m=<mi>] [-B=<bs>] [-W=<ms>] [-w=<mw>]
+
+Options:
+    -h --help                       Show this screen
+    -H=<host> --host=<host>         Address to listen on [default: 127.0.0.1]
+    -p=<port> --port=<port>         Port to listen on [default: 8080]
+    -n=<np> --processes=<np>        Number of worker processes, defaults to number of CPUs
+    -m=<mi> --max_in_flight=<mi>    Requests accepted at once before answering 503 [default: 64]
+    -B=<bs> --max_batch=<bs>        Most requests converted in one batch [default: 16]
+    -W=<ms> --batch_window=<ms>     Milliseconds to wait for more requests of a batch [default: 5]
+    -w=<mw> --max_width=<mw>        Widest output in cells a client can request [default: 400]
+"""
+import asyncio
+import http.client
+import io
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from urllib.parse import parse_qsl, quote, urlsplit
+
+import docopt
+from PIL import Image
+
+from emojiart import EmojiArt, converter_from_arguments, converter_options
+
+MODES = {
+    'ascii': [],
+    'edges': ['--edges'],
+    'fill': ['--fill'],
+    'shape': ['--shape'],
+    'emoji': ['--emoji'],
+}
+CLIENT_PARAMETERS = ('width', 'symbols_set', 'black_on_white', 'seed', 'color')
+PARAMETERS_DOC = u"""
+Usage:
+    request [options]
+
+Options:
+""" + converter_options()
+MAX_BODY = 64 * 2 ** 20
+MAX_WIDTH = 400
+STATUS_REASONS = {
+    200: 'OK',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    413: 'Payload Too Large',
+    422: 'Unprocessable Entity',
+    500: 'Internal Server Error',
+    503: 'Service Unavailable',
+}
+
+
+def parse_parameters(mode, query, max_width=MAX_WIDTH):
+    """Converter class and keyword arguments for mode and query string"""
+    argv = list(MODES[mode])
+    for name, value in parse_qsl(query, keep_blank_values=True):
+        if name not in CLIENT_PARAMETERS:
+            raise ValueError('unknown parameter: {}'.format(name))
+        argv.append('--' + name + ('=' + value if value else ''))
+    cls, kwargs = converter_from_arguments(
+        docopt.docopt(PARAMETERS_DOC, argv, help=False)
+    )
+    if kwargs['width'] > max_width:
+        raise ValueError('width above max_width {}'.format(max_width))
+    return cls, kwargs
+
+
+def check_width(kwargs, image_bytes, max_width=MAX_WIDTH):
+    """
+    Raise ValueError when output without width, sized by image, would be
+    wider than max_width. Only image header is read, images that cannot
+    be opened are left to conversion to report.
+    """
+    if kwargs['width']:
+        return
+    try:
+        image_width = Image.open(io.BytesIO(image_bytes)).size[0]
+    except (IOError, Image.DecompressionBombError):
+        return
+    if int(image_width * kwargs['height_to_width'] * kwargs['scale']) > max_width:
+        raise ValueError(
+            'image is wider than max_width {}, pass smaller width'.format(max_width)
+        )
+
+
+def init_worker():
+    EmojiArt.get_colors_kd_tree()
+
+
+def convert_batch(cls, items):
+    """Outputs or error messages of converting (image bytes, kwargs) items"""
+    results = []
+    for image_bytes, kwargs in items:
+        try:
+            output = io.BytesIO()
+            cls(Image.open(io.BytesIO(image_bytes)), **kwargs).render_to(output)
+            results.append((output.getvalue(), None))
+        except Exception as e:
+            results.append((None, '{}: {}'.format(type(e).__name__, e)))
+    return results
+
+
+class RenderServer(object):
+    def __init__(
+        self, processes=None, max_in_flight=64, max_batch=16, batch_window=0.005,
+        max_width=MAX_WIDTH
+    ):
+        self.processes = processes
+        self.executor = ProcessPoolExecutor(processes, initializer=init_worker)
+        self.max_in_flight = max_in_flight
+        self.max_width = max_width
+        self.max_batch = max_batch
+        self.batch_window = batch_window
+        self.in_flight = 0
+        self._batches = {}
+
+    async def convert(self, cls, image_bytes, kwargs):
+        """Queue conversion to batch of its mode, return (output, error)"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        batch = self._batches.get(cls)
+        if batch is None:
+            batch = self._batches[cls] = []
+            loop.call_later(self.batch_window, self._flush, cls, batch)
+        batch.append(((image_bytes, kwargs), future))
+        if len(batch) >= self.max_batch:
+            self._flush(cls, batch)
+        return await future
+
+    def _flush(self, cls, batch):
+        if self._batches.get(cls) is not batch:
+            return
+        del self._batches[cls]
+        loop = asyncio.get_running_loop()
+        futures = [future for _, future in batch]
+        executor = self.executor
+        try:
+            work = loop.run_in_executor(
+                executor, convert_batch, cls, [item for item, _ in batch]
+            )
+        except Exception as e:
+            self._fail(futures, e, executor)
+            return
+
+        def distribute(work):
+            if work.cancelled():
+                self._fail(futures, asyncio.CancelledError(), executor)
+            elif work.exception() is not None:
+                self._fail(futures, work.exception(), executor)
+            else:
+                for future, result in zip(futures, work.result()):
+                    if not future.done():
+                        future.set_result(result)
+        work.add_done_callback(distribute)
+
+    def _fail(self, futures, error, executor):
+        """Pass error to futures, starting new pool when executor broke"""
+        if isinstance(error, BrokenProcessPool) and executor is self.executor:
+            executor.shutdown(wait=False)
+            self.executor = ProcessPoolExecutor(
+                self.processes, initializer=init_worker
+            )
+        for future in futures:
+            if not future.done():
+                future.set_exception(error)
+
+    async def respond(self, method, target, body):
+        url = urlsplit(target)
+        mode = url.path.strip('/')
+        if mode not in MODES:
+            return 404, b'Unknown mode, use one of: ' + ', '.join(MODES).encode('ascii')
+        if method != 'POST':
+            return 405, b'Use POST with image bytes as body'
+        try:
+            cls, kwargs = parse_parameters(mode, url.query, self.max_width)
+            check_width(kwargs, body, self.max_width)
+        except (docopt.DocoptExit, ValueError) as e:
+            return 400, str(e).encode('utf-8')
+        if self.in_flight >= self.max_in_flight:
+            return 503, b'Too many requests in flight'
+        self.in_flight += 1
+        try:
+            output, error = await self.convert(cls, body, kwargs)
+        except BrokenProcessPool:
+            return 503, b'Worker process died, try again'
+        except Exception as e:
+            return 500, '{}: {}'.format(type(e).__name__, e).encode('utf-8')
+        finally:
+            self.in_flight -= 1
+        if error:
+            return 422, error.encode('utf-8')
+        return 200, output
+
+    async def handle(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            method, target, _ = request_line.decode('latin-1').split(' ', 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            length = int(headers.get('content-length', 0))
+            if length > MAX_BODY:
+                status, body = 413, b'Image too large'
+            else:
+                body = await reader.readexactly(length)
+                status, body = await self.respond(method, target, body)
+        except (ValueError, asyncio.IncompleteReadError):
+            status, body = 400, b'Malformed request'
+        except Exception as e:
+            status, body = 500, '{}: {}'.format(type(e).__name__, e).encode('utf-8')
+        try:
+            writer.write(
+                'HTTP/1.1 {} {}\r\nContent-Type: text/plain; charset=utf-8\r\n'
+                'Content-Length: {}\r\nConnection: close\r\n\r\n'.format(
+                    status, STATUS_REASONS[status], len(body)
+                ).encode('latin-1') + body
+            )
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(host='127.0.0.1', port=8080, **kwargs):
+    render_server = RenderServer(**kwargs)
+    server = await asyncio.start_server(render_server.handle, host, port)
+    async with server:
+        await server.serve_forever()
+
+
+def request(host, port, mode, image_bytes, **parameters):
+    """
+    Convert image_bytes on a running server, parameters are named like
+    long options, True is passed as flag. Return status and body.
+    """
+    query = '&'.join(
+        quote(name) if value is True else '{}={}'.format(quote(name), quote(str(value)))
+        for name, value in sorted(parameters.items()) if value is not False
+    )
+    connection = http.client.HTTPConnection(host, port)
+    try:
+        connection.request('POST', '/{}?{}'.format(mode, query), image_bytes)
+        response = connection.getresponse()
+        return response.status, response.read()
+    finally:
+        connection.close()
+
+
+if __name__ == '__main__':
+    arguments = docopt.docopt(__doc__)
+    asyncio.run(serve(
+        host=arguments['--host'],
+        port=int(arguments['--port']),
+        processes=int(arguments['--processes']) if arguments['--processes'] else None,
+        max_in_flight=int(arguments['--max_in_flight']),
+        max_batch=int(arguments['--max_batch']),
+        batch_window=float(arguments['--batch_window']) / 1000.0,
+        max_width=int(arguments['--max_width']),
+    ))
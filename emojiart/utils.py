@@ -1,8 +1,7 @@
-from configuration import config
+import os
 
-DEBUG = config.get('DEBUG', False)
+DEBUG = bool(os.environ.get('EMOJIART_DEBUG'))
 if DEBUG:
-    import os
     import shutil
     try:
         shutil.rmtree('out/debug')
@@ -19,7 +18,7 @@ debug_counter = 0
 def deb(im, name):
     global debug_counter
     if DEBUG:
-        print name
+        print(name)
         im.save('out/debug/' + str(debug_counter) + ' ' + name + '.png')
         debug_counter += 1
 
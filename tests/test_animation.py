@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import unittest
+
+import docopt
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'emojiart'))
+import emojiart
+from animation import Animation
+
+
+def parse(*argv):
+    return docopt.docopt(
+        emojiart.__doc__ + emojiart.converter_options(), argv=list(argv) + ['image.gif']
+    )
+
+
+class AnimationColorTest(unittest.TestCase):
+    def test_animate_with_color_is_rejected(self):
+        with self.assertRaises(ValueError):
+            emojiart.converter_from_arguments(parse('-a', '-C', '256'))
+
+    def test_animate_and_color_alone_are_accepted(self):
+        _, kwargs = emojiart.converter_from_arguments(parse('-a'))
+        self.assertIsNone(kwargs['color'])
+        _, kwargs = emojiart.converter_from_arguments(parse('-C', '256'))
+        self.assertEqual(kwargs['color'], '256')
+
+    def test_animation_with_color_is_rejected(self):
+        image = Image.new('RGB', (16, 16))
+        with self.assertRaises(ValueError):
+            Animation(image, emojiart.AsciiArt, color='256')
+
+
+if __name__ == '__main__':
+    unittest.main()
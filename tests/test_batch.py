@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from PIL import Image
+
+EMOJIART_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'emojiart')
+sys.path.insert(0, EMOJIART_DIR)
+from batch import collect_tasks
+
+
+class CollectTasksTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.output = os.path.join(self.directory, 'out')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def image(self, *parts):
+        path = os.path.join(self.directory, *parts)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        Image.new('RGB', (4, 4)).save(path)
+        return path
+
+    def outputs(self, tasks):
+        return sorted(os.path.relpath(output, self.output) for _, output in tasks)
+
+    def test_files_of_same_name_in_different_directories(self):
+        tasks = collect_tasks(
+            [self.image('a', 'x.png'), self.image('b', 'x.png')], self.output, '.txt'
+        )
+        self.assertEqual(self.outputs(tasks), [os.path.join('a', 'x.txt'), os.path.join('b', 'x.txt')])
+
+    def test_files_of_same_stem_keep_extension(self):
+        tasks = collect_tasks(
+            [self.image('x.png'), self.image('x.jpg'), self.image('y.png')], self.output, '.txt'
+        )
+        self.assertEqual(self.outputs(tasks), ['x.jpg.txt', 'x.png.txt', 'y.txt'])
+
+    def test_single_file_and_directory_keep_names(self):
+        self.assertEqual(self.outputs(collect_tasks([self.image('a', 'x.png')], self.output, '.txt')), ['x.txt'])
+        self.image('a', 'sub', 'y.png')
+        tasks = collect_tasks([os.path.join(self.directory, 'a')], self.output, '.txt')
+        self.assertEqual(self.outputs(tasks), [os.path.join('sub', 'y.txt'), 'x.txt'])
+
+    def test_remaining_collision_is_rejected(self):
+        with self.assertRaises(ValueError):
+            collect_tasks(
+                [self.image('x.png'), self.image('x.jpg'), self.image('x.png.png')],
+                self.output, '.txt'
+            )
+
+
+
+class CommandLineTest(unittest.TestCase):
+    def test_bad_option_exits_with_message(self):
+        process = subprocess.Popen(
+            [sys.executable, os.path.join(EMOJIART_DIR, 'batch.py'), '-w', 'abc', '-o', 'out', 'image.png'],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        _, stderr = process.communicate()
+        self.assertEqual(process.returncode, 1)
+        self.assertNotIn(b'Traceback', stderr)
+        self.assertIn(b'abc', stderr)
+
+
+if __name__ == '__main__':
+    unittest.main()
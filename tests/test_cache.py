@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import unittest
+
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'emojiart'))
+from cache import RenderCache
+from emojiart import AsciiArt
+
+
+def palette_image(color):
+    image = Image.new('P', (16, 16), 0)
+    image.putpalette(list(color) * 256)
+    return image
+
+
+class RenderCacheTest(unittest.TestCase):
+    def test_images_differing_only_in_palette_have_own_entries(self):
+        cache = RenderCache()
+        black = cache.render(AsciiArt, palette_image((0, 0, 0)), width=8)
+        white = cache.render(AsciiArt, palette_image((255, 255, 255)), width=8)
+        self.assertNotEqual(black, white)
+        self.assertEqual(cache.misses, 2)
+
+    def test_images_differing_only_in_transparency_have_own_entries(self):
+        cache = RenderCache()
+        image = palette_image((0, 0, 0))
+        transparent = image.copy()
+        transparent.info['transparency'] = 0
+        self.assertNotEqual(
+            cache.key(AsciiArt, image, {}), cache.key(AsciiArt, transparent, {})
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
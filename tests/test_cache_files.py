@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'emojiart'))
+import cache
+
+
+class CacheFilesTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_array_is_built_in_memory_when_directory_can_not_be_written(self):
+        blocker = os.path.join(self.directory, 'file')
+        open(blocker, 'w').close()
+        filename = os.path.join(blocker, 'cache', 'array.npy')
+        array = cache.load_or_create(filename, lambda: np.arange(4))
+        self.assertEqual(array.tolist(), [0, 1, 2, 3])
+        self.assertFalse(os.path.exists(filename))
+
+    def test_array_is_saved_and_loaded(self):
+        filename = os.path.join(self.directory, 'cache', 'array.npy')
+        cache.load_or_create(filename, lambda: np.arange(4))
+        array = cache.load_or_create(filename, lambda: self.fail('built again'))
+        self.assertEqual(array.tolist(), [0, 1, 2, 3])
+
+    def test_temp_file_is_removed_when_write_fails(self):
+        def write(f):
+            f.write(b'partial')
+            raise KeyboardInterrupt
+        with self.assertRaises(KeyboardInterrupt):
+            cache.atomic_write(os.path.join(self.directory, 'output.txt'), write)
+        self.assertEqual(os.listdir(self.directory), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
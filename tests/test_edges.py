@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import unittest
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'emojiart'))
+import edges
+
+
+def shapes_image(width=320, height=240):
+    image = Image.new('L', (width, height), 0)
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((40, 30, 200, 150), fill=180)
+    draw.ellipse((150, 90, 300, 220), fill=90)
+    return image
+
+
+class MaxMemoryTest(unittest.TestCase):
+    def test_strips_give_same_edges(self):
+        image = shapes_image()
+        planes = edges.PLANE_BYTES_PER_PIXEL * image.size[0] * image.size[1]
+        strips = edges.TILE_BYTES_PER_PIXEL * image.size[0] * 120
+        expected, _, _ = edges.edge_planes(image, 2)
+        for threads in (1, 3):
+            found, _, _ = edges.edge_planes(image, 2, planes + strips, threads)
+            self.assertTrue(np.array_equal(found, expected))
+
+    def test_budget_taken_by_planes_is_rejected(self):
+        image = shapes_image()
+        planes = edges.PLANE_BYTES_PER_PIXEL * image.size[0] * image.size[1]
+        with self.assertRaises(ValueError):
+            edges.edge_planes(image, 2, planes)
+
+
+if __name__ == '__main__':
+    unittest.main()
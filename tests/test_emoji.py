@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'emojiart'))
+from emojiart import EmojiArt
+
+
+class QuantizationTest(unittest.TestCase):
+    def test_out_of_range_quantization_is_rejected(self):
+        for quantization in (0, 9):
+            with self.assertRaises(ValueError):
+                EmojiArt(Image.new('RGB', (8, 8)), width=4, matching='cube', quantization=quantization)
+            with self.assertRaises(ValueError):
+                EmojiArt.get_colors_cube(quantization)
+
+
+
+class CubeMatchingTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.addCleanup(setattr, EmojiArt, 'cache_dir', EmojiArt.cache_dir)
+        EmojiArt.cache_dir = directory
+
+    def test_cube_matching_does_not_use_kd_tree(self):
+        image = Image.linear_gradient('L').convert('RGB')
+        EmojiArt.get_colors_cube(3)
+
+        def get_colors_kd_tree():
+            raise AssertionError('cube matching used KD-tree')
+        self.addCleanup(
+            setattr, EmojiArt, 'get_colors_kd_tree',
+            EmojiArt.__dict__['get_colors_kd_tree']
+        )
+        EmojiArt.get_colors_kd_tree = staticmethod(get_colors_kd_tree)
+        art = EmojiArt(image, width=20, matching='cube', quantization=3)
+        self.assertEqual(len(list(art.iter_encoded_lines())), art._pixel_matrix.height)
+
+
+
+class BatchedMatchingTest(unittest.TestCase):
+    def test_rows_are_matched_in_batches(self):
+        image = Image.open(os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), '..', 'test_images', 'mos.png'
+        ))
+        art = EmojiArt(image, width=40)
+        calls = []
+        matching_engine = art.pixels_to_emoji_indexes
+
+        def counted(pixels):
+            calls.append(len(pixels))
+            return matching_engine(pixels)
+        art.pixels_to_emoji_indexes = counted
+        lines = list(art.iter_encoded_lines())
+        self.assertEqual(calls, [art._pixel_matrix.height])
+        art.match_batch_cells = 3 * art._pixel_matrix.width
+        del calls[:]
+        self.assertEqual(list(art.iter_encoded_lines()), lines)
+        self.assertEqual(max(calls), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
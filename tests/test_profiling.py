@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'emojiart'))
+import profiling
+
+
+class ImportModulesTest(unittest.TestCase):
+    def test_imports_are_stage_of_their_own(self):
+        sys.modules.pop('colorsys', None)
+        with profiling.Profile() as profile:
+            profiling.import_modules('colorsys')
+            with profiling.stage('work'):
+                profiling.import_modules('colorsys')
+        self.assertIn('colorsys', sys.modules)
+        self.assertEqual(list(profile.stages), ['import', 'work'])
+        self.assertEqual(profile.stages['import'].calls, 1)
+
+
+
+class PeakMemoryTest(unittest.TestCase):
+    @unittest.skipIf(
+        not hasattr(profiling.tracemalloc, 'reset_peak'), 'needs tracemalloc.reset_peak'
+    )
+    def test_stage_freeing_its_allocations_reports_peak(self):
+        with profiling.Profile(memory=True) as profile:
+            with profiling.stage('outer'):
+                with profiling.stage('inner'):
+                    block = bytearray(2 ** 20)
+                    del block
+                free = bytearray(2 ** 19)
+                del free
+        for name in ('outer', 'inner'):
+            self.assertGreater(profile.stages[name].peak_bytes, 0.9 * 2 ** 20)
+
+    def test_without_memory_tracing_peak_is_not_available(self):
+        with profiling.Profile() as profile:
+            with profiling.stage('work', 10):
+                pass
+        self.assertIsNone(profile.stages['work'].peak_bytes)
+        self.assertIn('n/a', profile.format())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'emojiart'))
+from emojiart import AsciiArt, FillAsciiArt
+
+
+def jpeg(width=1600, height=1200):
+    y, x = np.mgrid[0:height, 0:width]
+    pixels = (127 + 127 * np.sin(x / 37.0) * np.cos(y / 23.0)).astype(np.uint8)
+    output = io.BytesIO()
+    Image.fromarray(pixels, 'L').convert('RGB').save(output, 'JPEG')
+    return output.getvalue()
+
+
+class DraftTest(unittest.TestCase):
+    def test_image_of_caller_is_not_changed(self):
+        image = Image.open(io.BytesIO(jpeg()))
+        AsciiArt(image, width=40)
+        self.assertEqual(image.size, (1600, 1200))
+        image.load()
+        self.assertEqual(image.size, (1600, 1200))
+
+    def test_png_from_disk_converts_twice(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'image.png')
+        Image.open(io.BytesIO(jpeg())).save(path)
+        image = Image.open(path)
+        art = AsciiArt(image, width=40)
+        again = AsciiArt(image, width=40)
+        self.assertEqual(render(art), render(again))
+        art.rerender(width=400)
+        fresh = AsciiArt(Image.open(path), width=400)
+        self.assertEqual(render(art), render(fresh))
+        image.load()
+        self.assertEqual(image.size, (1600, 1200))
+
+
+def render(art):
+    output = io.BytesIO()
+    art.render_to(output)
+    return output.getvalue()
+
+
+class RerenderTest(unittest.TestCase):
+    def test_rerender_to_larger_width_matches_fresh_render(self):
+        data = jpeg()
+        for cls in (AsciiArt, FillAsciiArt):
+            art = cls(Image.open(io.BytesIO(data)), width=40)
+            art.rerender(width=400)
+            fresh = cls(Image.open(io.BytesIO(data)), width=400)
+            self.assertEqual(render(art), render(fresh))
+
+    def test_update_image_scales_from_full_resolution(self):
+        data = jpeg()
+        art = AsciiArt(Image.open(io.BytesIO(jpeg(800, 600))), width=40)
+        art.rerender(width=400)
+        art.update_image(Image.open(io.BytesIO(data)))
+        fresh = AsciiArt(Image.open(io.BytesIO(data)), width=400)
+        self.assertEqual(render(art), render(fresh))
+
+
+if __name__ == '__main__':
+    unittest.main()
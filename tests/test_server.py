@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import sys
+import threading
+import unittest
+
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'emojiart'))
+
+
+def png(width=64, height=48):
+    output = io.BytesIO()
+    Image.linear_gradient('L').resize((width, height)).save(output, 'PNG')
+    return output.getvalue()
+
+
+@unittest.skipIf(sys.version_info < (3, 7), 'server needs Python 3.7+')
+class ParseParametersTest(unittest.TestCase):
+    def test_client_parameters(self):
+        import server
+        cls, kwargs = server.parse_parameters('fill', 'width=20&symbols_set=block&color=256')
+        self.assertEqual((kwargs['width'], kwargs['symbols_set_name'], kwargs['color']), (20, 'block', '256'))
+
+    def test_other_parameters_are_rejected(self):
+        import server
+        for query in ('font=/etc/passwd', 'quantization=12', 'threads=64', 'max_memory=1'):
+            with self.assertRaises(ValueError):
+                server.parse_parameters('emoji', query)
+
+    def test_width_above_max_width_is_rejected(self):
+        import server
+        server.parse_parameters('shape', 'width=40', max_width=40)
+        with self.assertRaises(ValueError):
+            server.parse_parameters('shape', 'width=41', max_width=40)
+
+
+@unittest.skipIf(sys.version_info < (3, 7), 'server needs Python 3.7+')
+class RenderServerTest(unittest.TestCase):
+    def setUp(self):
+        import asyncio
+        import server
+        self.render_server = server.RenderServer(processes=1, max_width=100)
+        self.loop = asyncio.new_event_loop()
+        listener = self.loop.run_until_complete(asyncio.start_server(
+            self.render_server.handle, '127.0.0.1', 0
+        ))
+        self.port = listener.sockets[0].getsockname()[1]
+        thread = threading.Thread(target=self.loop.run_forever)
+        thread.start()
+
+        def stop():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            thread.join()
+            listener.close()
+            self.loop.run_until_complete(listener.wait_closed())
+            self.loop.close()
+            self.render_server.executor.shutdown()
+        self.addCleanup(stop)
+
+    def request(self, mode, image_bytes, **parameters):
+        import server
+        return server.request('127.0.0.1', self.port, mode, image_bytes, **parameters)
+
+    def test_conversion(self):
+        status, body = self.request('ascii', png(), width=20)
+        self.assertEqual(status, 200)
+        self.assertEqual(len(body.splitlines()[0]), 20)
+
+    def test_wide_outputs_are_rejected(self):
+        self.assertEqual(self.request('shape', png(), width=20000)[0], 400)
+        # without width output is 1.8 times as wide as image
+        self.assertEqual(self.request('ascii', png(width=64))[0], 400)
+        self.assertEqual(self.request('ascii', png(width=48))[0], 200)
+
+    def test_new_pool_after_worker_died(self):
+        self.assertEqual(self.request('ascii', png(), width=20)[0], 200)
+        broken = self.render_server.executor
+        for process in list(broken._processes.values()):
+            process.kill()
+            process.join()
+        self.assertEqual(self.request('ascii', png(), width=20)[0], 503)
+        self.assertIsNot(self.render_server.executor, broken)
+        self.assertEqual(self.request('ascii', png(), width=20)[0], 200)
+
+
+if __name__ == '__main__':
+    unittest.main()